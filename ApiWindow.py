@@ -13,27 +13,29 @@ from config_ import Config
 import requests
 import os, json
 import sqlite3
-from Tile_Downloader import download_panorama
+from Download_Pipeline import PanoramaPipeline
 from dotenv import load_dotenv
 from utils import resolve_path
 from pathlib import Path
 from Metadata_scanner_grid_search import StreetViewDensityScanner
+from Scan_Database import migrate_scan_db, query_results as scan_query_results, SCHEMA_VERSION
+from Scan_Region import region_from_shape
 
 class CoordinateReceiver(QObject):
-    # Emitted when JavaScript sends coordinates: list of [lat, lng] or list of lists
+    # Emitted when JavaScript sends a drawn shape: {type, coords: [[lat, lng], ...], radius} (see Scan_Region)
     coordinatesReceived = pyqtSignal(object)
 
     @pyqtSlot('QVariant')
     def receiveCoordinates(self, coords):
-        # coords is expected as a JS array of lat/lng pairs
         self.coordinatesReceived.emit(coords)
 
 class StreetViewDownloader(QThread):
     progress = pyqtSignal(int, int)  # current, total
     finished = pyqtSignal()
 
-    def __init__(self, output_dir, max_images, logger: Logger, config: Config, FOUND_COORDS: list[tuple[float,float]]):
+    def __init__(self, output_dir, max_images, logger: Logger, config: Config, FOUND_COORDS: list[tuple[float,float]], cache_only: bool = False):
         super().__init__()
+        self.cache_only = cache_only
         self.coords = FOUND_COORDS
         self.api_key = os.getenv("API_KEY") #api_key
         self.config = config
@@ -44,20 +46,10 @@ class StreetViewDownloader(QThread):
 
     def run(self):
         try:
-            total = len(self.coords)
-            count = 0
-            for i, (lat, lng, pan_id) in enumerate(self.coords, 1):
-                if self.max_images and count >= self.max_images:
-                    self.logger.log_status(f"Reached max_images limit: {self.max_images}")
-                    break
-                try:
-                    self.logger.log_status(f"Requesting Street View for ({lat}, {lng})")
-                    download_panorama(pano_id=pan_id, save_dir=self.output_dir, coords=(lat, lng))
-                    count += 1
-                    self.logger.log_status(f"Saved image {self.region}_{lat}_{lng}")
-                except Exception as e:
-                    self.logger.log_exception(f"Failed to download at ({lat},{lng}): {e}")
-                self.progress.emit(i, total)
+            self.pipeline = PanoramaPipeline(self.output_dir, self.logger, self.config, progress=self.progress.emit)
+            if self.max_images and len(self.coords) > self.max_images:
+                self.logger.log_status(f"Limiting download to max_images: {self.max_images}")
+            self.pipeline.run(self.coords, max_images=self.max_images, cache_only=self.cache_only)
             self.logger.log_status("Street View download finished")
         except Exception as e:
             self.logger.log_exception(f"Downloader thread failed: {e}")
@@ -74,6 +66,8 @@ class ApiWindow(QWidget):
         QTimer.singleShot(0, lambda: self.set_api_key(self.secrets_path))
         self.DB_PATH = self.config.get_database_path()
         self.FOUND_COORDS = []
+        self.found_pano_ids = set()
+        self.current_shape_coords = None
         self.region = self.config.get_general_data()["region"]
         self.output_dir = self.config.get_dwnd_file_path()
         os.makedirs(self.output_dir, exist_ok=True)
@@ -123,8 +117,12 @@ class ApiWindow(QWidget):
         top_layout.addWidget(self.city_dropdown)
 
         self.rect_btn = QPushButton("Rectangle Select")
+        self.circle_btn = QPushButton("Circle Select")
+        self.poly_btn = QPushButton("Polygon Select")
         self.clear_btn = QPushButton("Clear Selection")
         top_layout.addWidget(self.rect_btn)
+        top_layout.addWidget(self.circle_btn)
+        top_layout.addWidget(self.poly_btn)
         top_layout.addWidget(self.clear_btn)
 
         self.populate_city_dropdown()
@@ -145,6 +143,10 @@ class ApiWindow(QWidget):
         self.download_btn = QPushButton("Download Images")
         top_layout.addWidget(self.download_btn)
 
+        # renders the selection again from cached faces, e.g. after changing the interpolation or codec
+        self.rerender_btn = QPushButton("Re-render from Cache")
+        top_layout.addWidget(self.rerender_btn)
+
         self.layout.addLayout(top_layout)
 
         # Web view for map
@@ -158,11 +160,12 @@ class ApiWindow(QWidget):
 
         # Connect signals
         self.rect_btn.clicked.connect(lambda: self.run_js('enableRectangle()'))
-        # self.circle_btn.clicked.connect(lambda: self.run_js('enableCircle()'))
-        # self.poly_btn.clicked.connect(lambda: self.run_js('enablePolygon()'))
-        self.clear_btn.clicked.connect(lambda: self.run_js('clearSelection()'))
+        self.circle_btn.clicked.connect(lambda: self.run_js('enableCircle()'))
+        self.poly_btn.clicked.connect(lambda: self.run_js('enablePolygon()'))
+        self.clear_btn.clicked.connect(self.clear_selection)
         self.folder_btn.clicked.connect(self.choose_folder)
-        self.download_btn.clicked.connect(self.start_download)
+        self.download_btn.clicked.connect(lambda: self.start_download())
+        self.rerender_btn.clicked.connect(lambda: self.start_download(cache_only=True))
 
     def populate_city_dropdown(self):
         self.city_dropdown.clear()
@@ -287,18 +290,13 @@ class ApiWindow(QWidget):
         except Exception as e:
             self.logger.log_exception(f"Failed to update map index: {e}")
 
-    def query_results(self, db_path, north, south, east, west):
+    def query_results(self, db_path, north, south, east, west, region=None):
         conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-
-        query = """
-            SELECT c.lat, c.lon, r.pano_id
-            FROM coords c
-            JOIN results r ON c.id = r.coord_id
-            WHERE c.lat <= ? AND c.lat >= ? AND c.lon <= ? AND c.lon >= ?
-        """
-        cur.execute(query, (north, south, east, west))
-        results = cur.fetchall()
+        # databases from older scans get their spatial index on first use
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self.logger.log_status(f"Indexing {db_path}, this is only done once")
+            migrate_scan_db(conn)
+        results = scan_query_results(conn, north, south, east, west, region)
         conn.close()
         self.logger.log_status(results)
         return results
@@ -373,9 +371,11 @@ class ApiWindow(QWidget):
             }} else if (e.type === 'polygon') {{
             e.overlay.getPath().forEach(pt => coords.push([pt.lat(), pt.lng()]));
             }}
-            // send coords to Python
+            let shape = {{type: e.type, coords: coords}};
+            if (e.type === 'circle') {{ shape.radius = e.overlay.getRadius(); }}
+            // send the shape to Python
             new QWebChannel(qt.webChannelTransport, channel => {{
-            channel.objects.coordReceiver.receiveCoordinates(coords);
+            channel.objects.coordReceiver.receiveCoordinates(shape);
         }});
       }});
     }}
@@ -410,21 +410,33 @@ class ApiWindow(QWidget):
             self.logger.log_exception(f"Folder selection failed: {e}")
 
     def on_coordinates(self, coords):
-        # coords received from JS drawing
-        self.logger.log_status(f"Coordinates received: {coords}")
-        self.logger.log_status("Received coords:", coords)
-        north = float(coords[0][0])
-        south = float(coords[1][0])
-        east = float(coords[0][1])
-        west = float(coords[1][1])
-        data = self.query_results(self.DB_PATH, north, south, east, west)
-        for i in data:
-            self.FOUND_COORDS.append(i)
+        # shape received from JS drawing; results are queried on its bounding box and
+        # filtered to the shape itself
+        self.logger.log_status(f"Shape received: {coords}")
+        try:
+            region = region_from_shape(coords)
+        except (ValueError, TypeError) as e:
+            self.logger.log_exception(f"Could not use the drawn shape: {e}")
+            return
+        north, south, east, west = region.bounds()
+        data = self.query_results(self.DB_PATH, north, south, east, west, region)
+        for lat, lng, pano_id in data:
+            # overlapping selections return the same panoramas again
+            if pano_id in self.found_pano_ids:
+                continue
+            self.found_pano_ids.add(pano_id)
+            self.FOUND_COORDS.append((lat, lng, pano_id))
         self.logger.log_status(f"found {len(data)} results in {coords}")
         print(f'found {len(self.FOUND_COORDS)} results in selected')
         self.current_shape_coords = coords
 
-    def start_download(self):
+    def clear_selection(self):
+        self.run_js('clearSelection()')
+        self.FOUND_COORDS = []
+        self.found_pano_ids = set()
+        self.current_shape_coords = None
+
+    def start_download(self, cache_only: bool = False):
         try:
             coords = self.current_shape_coords
             if not coords:
@@ -436,16 +448,17 @@ class ApiWindow(QWidget):
                 self.logger.log_status("No output folder selected")
                 return
             self.downloader = StreetViewDownloader(
-                out, max_images, self.logger, self.config, self.FOUND_COORDS
+                out, max_images, self.logger, self.config, self.FOUND_COORDS, cache_only
             )
             self.logger.log_status(self.FOUND_COORDS)
             self.downloader.progress.connect(self.update_progress)
             self.downloader.finished.connect(lambda: self.logger.log_status("Download thread finished"))
-            self.progress.setMaximum(len(coords))
+            self.progress.setMaximum(len(self.FOUND_COORDS))
             self.downloader.start()
         except Exception as e:
             self.logger.log_exception(f"Failed to start download: {e}")
 
     def update_progress(self, current, total):
+        self.progress.setMaximum(total)
         self.progress.setValue(current)
         self.logger.log_status(f"Progress: {current}/{total}")
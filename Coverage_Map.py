@@ -0,0 +1,73 @@
+# Scan coverage map: the scan database drawn as COVERAGE_CELL squares instead of one marker per
+# coordinate. The page (folium / Leaflet) is written and loaded once; after that every refresh asks
+# coverage_cells for the cells changed since the last version it saw and pushes just those to the
+# page with runJavaScript, so the cost of a refresh follows the scan's progress, not its size.
+# Colours follow the old per-point map: green has panoramas, blue scanned without any, gray queued.
+
+import json
+import sqlite3
+
+import folium
+
+from Scan_Database import COVERAGE_CELL, LATTICE_SCALE
+
+# JS run once in the page: keeps one rectangle per cell and restyles it when the cell changes.
+# __MAP__ is replaced by the folium map's variable name.
+_PAGE_SCRIPT = """
+    var coverageCells = {};
+    var coverageCell = __CELL__;
+    function updateCells(cells) {
+        cells.forEach(function(c) {
+            var key = c[0] + ',' + c[1];
+            var total = c[2], scanned = c[3], hits = c[4];
+            var style = {
+                color: hits ? 'green' : scanned == total ? 'blue' : 'gray',
+                weight: 0,
+                fillOpacity: 0.15 + 0.6 * (total ? scanned / total : 0)
+            };
+            var rect = coverageCells[key];
+            if (!total) {
+                if (rect) { __MAP__.removeLayer(rect); delete coverageCells[key]; }
+                return;
+            }
+            if (rect) {
+                rect.setStyle(style);
+            } else {
+                var south = c[0] * coverageCell, west = c[1] * coverageCell;
+                rect = L.rectangle([[south, west], [south + coverageCell, west + coverageCell]], style).addTo(__MAP__);
+                coverageCells[key] = rect;
+            }
+            rect.bindTooltip(scanned + '/' + total + ' scanned, ' + hits + ' with panoramas');
+        });
+    }
+"""
+
+
+def write_coverage_page(path, center: tuple, zoom: int = 13):
+    """
+    Write the empty coverage map page centred on center (lat, lon); cells are added with cells_script
+    """
+    m = folium.Map(location=center, zoom_start=zoom, prefer_canvas=True)
+    script = _PAGE_SCRIPT.replace("__MAP__", m.get_name()).replace("__CELL__", repr(COVERAGE_CELL / LATTICE_SCALE))
+    m.get_root().script.add_child(folium.Element(script))
+    m.save(path)
+
+
+def changed_cells(conn: sqlite3.Connection, since: int = 0) -> tuple[list, int]:
+    """
+    Cells changed after version since, as [cell_lat, cell_lon, total, scanned, hits] lists,
+    and the version to pass next time
+    """
+    rows = conn.execute(
+        "SELECT cell_lat, cell_lon, total, scanned, hits, version FROM coverage_cells WHERE version > ?",
+        (since,)).fetchall()
+    if not rows:
+        return [], since
+    return [list(row[:5]) for row in rows], max(row[5] for row in rows)
+
+
+def cells_script(cells: list) -> str:
+    """
+    JS call applying changed cells to the page written by write_coverage_page
+    """
+    return f"updateCells({json.dumps(cells)});"
@@ -8,7 +8,16 @@ from PyQt5.QtGui import QPixmap, QImage, QPen, QPainter
 from PyQt5.QtCore import QObject, QThread, pyqtSignal, pyqtSlot, QPointF, Qt
 from config_ import Config
 from AppLogger import Logger
-from utils import ensure_directory_exists, save_image, resolve_path
+from utils import ensure_directory_exists, save_image, resolve_path, load_image, load_preview
+
+
+# Raw panoramas written by the downloader's npy codec. load_image reads them, but the classifier's
+# Image.open does not, so they are accepted here rather than in the shared allowed_file_types.
+RAW_PANORAMA_TYPES = (".npy",)
+
+
+def get_input_file_types(config: Config) -> tuple:
+    return tuple(item.strip() for item in config.get_allowed_file_types().split(',')) + RAW_PANORAMA_TYPES
 
 
 ### Show what types of photo types are allowed in the file browse dialog
@@ -33,9 +42,7 @@ class ImageProcessorWorker(QObject):
         self.save_folder = save_folder
         ensure_directory_exists(self.save_folder)
 
-        self.supported_files = tuple(
-            item.strip() for item in self.config.get_allowed_file_types().split(',')
-        )
+        self.supported_files = get_input_file_types(self.config)
 
     def _parts_of_img(self, img, dimensions: tuple[int, int] = (100, 100)) -> list:
         x, y = dimensions
@@ -60,7 +67,8 @@ class ImageProcessorWorker(QObject):
             size_img = tuple(int(i) for i in size_img.split(','))
         blur_region = self.config.get_blur_size()
 
-        image = cv2.imread(str(image_path))
+        # always the full-resolution panorama: the crop geometry is in its pixels
+        image = load_image(image_path)
         if image is None:
             return {"source_file": str(image_path), "saved_files": [], "success": False}
 
@@ -128,6 +136,8 @@ class ImageCropperView(QGraphicsView):
         self.h_line = None
         self.v_line = None
         self.img_height = 100
+        # displayed image height over the full panorama's, when a pyramid level is shown
+        self.scale = 1.0
         self.cv_img = None
         self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
@@ -137,9 +147,10 @@ class ImageCropperView(QGraphicsView):
         super().resizeEvent(event)
         self._update_display()
 
-    def set_image(self, cv_img, img_height):
+    def set_image(self, cv_img, img_height, scale: float = 1.0):
         self.scene.clear()
         self.img_height = img_height
+        self.scale = scale
         self.cv_img = cv_img
         self._update_display()
 
@@ -150,7 +161,7 @@ class ImageCropperView(QGraphicsView):
         if self.cv_img is None:
             return
 
-        img = cv2.cvtColor(self.cv_img, cv2.COLOR_BGR2RGB)
+        img = cv2.cvtColor(np.ascontiguousarray(self.cv_img), cv2.COLOR_BGR2RGB)
         height, width, channels = img.shape
         bytes_per_line = channels * width
         q_img = QImage(img.data, width, height, bytes_per_line, QImage.Format_RGB888)
@@ -166,7 +177,7 @@ class ImageCropperView(QGraphicsView):
         pen = QPen(Qt.red, 5, Qt.DashLine)
 
         # Horizontal line (modifiable height)
-        y = min(max(0, self.img_height), height)
+        y = min(max(0, round(self.img_height * self.scale)), height)
         y = height-y
         self.h_line = self.scene.addLine(0, y, width, y, pen)
 
@@ -281,17 +292,15 @@ class CropWindow(QWidget):
     def update_image_display(self):
         input_folder = Path(self.folder_input.text())
         image_paths = list(input_folder.glob("*"))
-        self.supported_files = tuple(
-            item.strip() for item in self.config.get_allowed_file_types().split(',')
-        )
+        self.supported_files = get_input_file_types(self.config)
         first_image_path = next((p for p in image_paths if p.suffix.lower() in self.supported_files), None)
 
 
         if first_image_path:
             self.logger.log_status(f"Read {str(first_image_path)} for display")
-            img = cv2.imread(str(first_image_path))
+            img, scale = load_preview(first_image_path, self.image_view.width())
             height_str = self.config.get_image_size().split(',')[1]
-            self.image_view.set_image(img, int(height_str))
+            self.image_view.set_image(img, int(height_str), scale)
 
     @pyqtSlot()
     def change_save_folder(self):
@@ -349,8 +358,8 @@ class CropWindow(QWidget):
             first_image_path = next((p for p in image_paths if p.suffix.lower() in self.worker.supported_files), None)
 
             if first_image_path:
-                img = cv2.imread(str(first_image_path))
-                self.image_view.set_image(img, new_height)
+                img, scale = load_preview(first_image_path, self.image_view.width())
+                self.image_view.set_image(img, new_height, scale)
 
             self.logger.log_status(f"Crop height updated to {new_height}px")
 
@@ -0,0 +1,181 @@
+# Persistent record of panorama downloads, keyed by (pano_id, face_size).
+# Lets the downloader skip panoramas that are already on disk (at the path the current run would
+# write them to) and resume a batch after a crash.
+# Also keeps the pre-screen score of every panorama so the threshold can be re-tuned without refetching.
+# latitude_band records partial-sphere panoramas (NULL = full sphere), so turning partial_sphere off
+# downloads them again.
+
+import os
+import time
+import sqlite3
+import threading
+
+from AppLogger import Logger
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"  # rejected by the pre-screen, re-checked against the threshold on every run
+
+
+def _same_path(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+class DownloadManifest:
+    def __init__(self, db_path, logger: Logger):
+        """
+        Opens (and creates if needed) the manifest database at db_path.
+        A single connection is shared by the pipeline threads behind a lock.
+        """
+        self.db_path = str(db_path)
+        self.logger = logger
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.init_db()
+
+    def init_db(self):
+        with self.lock:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    pano_id TEXT NOT NULL,
+                    face_size INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    path TEXT,
+                    bytes INTEGER,
+                    lat REAL, lon REAL,
+                    updated_at REAL,
+                    score REAL,
+                    latitude_band REAL,
+                    PRIMARY KEY (pano_id, face_size)
+                )""")
+            # manifests created before the pre-screen have no score column
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(downloads)")}
+            if "score" not in columns:
+                self.conn.execute("ALTER TABLE downloads ADD COLUMN score REAL")
+            if "latitude_band" not in columns:
+                self.conn.execute("ALTER TABLE downloads ADD COLUMN latitude_band REAL")
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get(self, pano_id: str, face_size: int):
+        """
+        Returns (status, path, bytes) for the panorama or None if it was never queued
+        """
+        with self.lock:
+            cur = self.conn.execute(
+                "SELECT status, path, bytes FROM downloads WHERE pano_id=? AND face_size=?",
+                (pano_id, face_size))
+            return cur.fetchone()
+
+    def is_complete(self, pano_id: str, face_size: int, targets: list[str] = None, latitude_band=None,
+                    required: list[str] = None) -> bool:
+        """
+        True when the panorama is marked done and its file is still on disk with the recorded size.
+        targets: the files this run would write for it; a panorama recorded at any other path
+        (another output folder, codec or render mode) is not complete
+        required: other files the run writes that must exist too, e.g. the configured pyramid levels
+        latitude_band: band this run renders, None for the full sphere; a panorama rendered with
+        a narrower band is not complete
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status, path, bytes, latitude_band FROM downloads WHERE pano_id=? AND face_size=?",
+                (pano_id, face_size)).fetchone()
+        if row is None or row[0] != DONE:
+            return False
+        _, path, size, recorded_band = row
+        if not path:
+            return False
+        if recorded_band is not None and (latitude_band is None or recorded_band < latitude_band):
+            return False
+        if targets is not None and _same_path(path) not in {_same_path(t) for t in targets}:
+            return False
+        if required and not all(os.path.exists(p) for p in required):
+            return False
+        return os.path.exists(path) and os.path.getsize(path) == size
+
+    def plan(self, jobs: list[tuple[float, float, str]], face_size: int, targets=None,
+             force: bool = False, latitude_band=None, required=None) -> list[tuple[float, float, str]]:
+        """
+        Drop duplicate pano_ids and panoramas that are already complete, and record the rest as pending.
+        targets: targets(job) -> paths the current run writes for the job (see is_complete)
+        force: keep complete panoramas too, for a re-render of faces that are already cached
+        latitude_band: band the current run renders, None for the full sphere (see is_complete)
+        required: required(job) -> other paths that must exist for the job (see is_complete)
+        Returns the jobs that still need downloading, in their original order.
+        """
+        remaining, seen = [], set()
+        skipped = 0
+        for job in jobs:
+            lat, lng, pano_id = job
+            if pano_id in seen:
+                continue
+            seen.add(pano_id)
+            if not force and self.is_complete(pano_id, face_size, targets(job) if targets else None, latitude_band,
+                                              required(job) if required else None):
+                skipped += 1
+                continue
+            remaining.append(job)
+
+        now = time.time()
+        with self.lock:
+            self.conn.executemany("""
+                INSERT INTO downloads(pano_id, face_size, status, lat, lon, updated_at) VALUES(?,?,?,?,?,?)
+                ON CONFLICT(pano_id, face_size) DO UPDATE SET status=excluded.status, updated_at=excluded.updated_at
+                """, [(pano_id, face_size, PENDING, lat, lng, now) for lat, lng, pano_id in remaining])
+            self.conn.commit()
+
+        self.logger.log_status(f"Manifest: {skipped} panoramas already downloaded, {len(remaining)} to fetch")
+        return remaining
+
+    def mark_done(self, pano_id: str, face_size: int, path: str, latitude_band=None):
+        size = os.path.getsize(path)
+        with self.lock:
+            self.conn.execute(
+                "UPDATE downloads SET status=?, path=?, bytes=?, latitude_band=?, updated_at=? WHERE pano_id=? AND face_size=?",
+                (DONE, path, size, latitude_band, time.time(), pano_id, face_size))
+            self.conn.commit()
+
+    def get_score(self, pano_id: str, face_size: int):
+        """
+        Stored pre-screen score of the panorama, None if it was never scored
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT score FROM downloads WHERE pano_id=? AND face_size=?", (pano_id, face_size)).fetchone()
+        return row[0] if row else None
+
+    def set_score(self, pano_id: str, face_size: int, score: float):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE downloads SET score=?, updated_at=? WHERE pano_id=? AND face_size=?",
+                (score, time.time(), pano_id, face_size))
+            self.conn.commit()
+
+    def mark_skipped(self, pano_id: str, face_size: int):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE downloads SET status=?, updated_at=? WHERE pano_id=? AND face_size=?",
+                (SKIPPED, time.time(), pano_id, face_size))
+            self.conn.commit()
+
+    def mark_failed(self, pano_id: str, face_size: int):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE downloads SET status=?, updated_at=? WHERE pano_id=? AND face_size=?",
+                (FAILED, time.time(), pano_id, face_size))
+            self.conn.commit()
+
+    def counts(self) -> dict[str, int]:
+        """
+        Number of manifest entries per status
+        """
+        with self.lock:
+            cur = self.conn.execute("SELECT status, COUNT(*) FROM downloads GROUP BY status")
+            return dict(cur.fetchall())
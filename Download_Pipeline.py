@@ -0,0 +1,383 @@
+# Staged panorama download pipeline
+#   fetch (threads, network bound) → reproject (threads, CPU bound) → write (threads, disk bound)
+# Stages are connected by bounded queues so a slow stage applies back-pressure instead of
+# letting fetched faces pile up in memory.
+# The reprojection kernels release the GIL, so reprojecting in-process is the default. With
+# [Download] reproject_workers > 0 a process pool is used instead; it is started once and kept,
+# since spawned workers re-import the whole app, and stacks go through shared memory, not pickles.
+
+import time
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from AppLogger import Logger
+from config_ import Config
+from Download_Manifest import DownloadManifest
+from Quota_Manager import QuotaExceeded
+from Prescreen import building_score, get_prescreen_settings, break_even
+from Tile_Downloader import get_remap_table, fetch_cube_faces, stack_faces, reproject_stack, panorama_path, save_panorama, save_pyramid, get_pyramid_levels, crop_paths, get_latitude_band, get_fetch_faces, crop_band_coverage, crop_top_latitude, faces_cached, output_region, split_crops
+from utils import resolve_path, pyramid_level_path
+
+# Marks the end of a stage's input
+_DONE = object()
+
+_process_pool = None
+_process_pool_workers = 0
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Reprojection process pool with workers processes, kept across pipeline runs
+    """
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_workers != workers:
+            if _process_pool is not None:
+                _process_pool.shutdown()
+            _process_pool = ProcessPoolExecutor(max_workers=workers)
+            _process_pool_workers = workers
+    return _process_pool
+
+
+def _reproject_shared(stack_name: str, stack_shape: tuple, out_name: str, out_shape: tuple,
+                      mode: str, render_mode: str, latitude_band):
+    """
+    Process-pool entry point: reproject the stack in shared memory block stack_name into out_name.
+    Worker processes memory-map the same persisted remap table.
+    """
+    stack_shm = shared_memory.SharedMemory(name=stack_name)
+    out_shm = shared_memory.SharedMemory(name=out_name)
+    try:
+        stack = np.ndarray(stack_shape, dtype=np.uint8, buffer=stack_shm.buf)
+        out = np.ndarray(out_shape, dtype=np.uint8, buffer=out_shm.buf)
+        reproject_stack(stack, mode, render_mode, 1, latitude_band, out=out)
+        del stack, out
+    finally:
+        stack_shm.close()
+        out_shm.close()
+
+
+class PanoramaPipeline:
+    def __init__(self, save_dir, logger: Logger, config: Config, progress=None):
+        """
+        Args:
+            save_dir (str): Folder the panoramas are written to
+            logger (Logger): App logger
+            config (Config): App config, stage sizes are read from [Download]
+            progress (callable): Called as progress(done, total) after every panorama, success or not
+        Panoramas already recorded as done in the download manifest are skipped.
+        """
+        self.save_dir = save_dir
+        self.logger = logger
+        self.config = config
+        self.progress = progress
+        self.region = self.config.get_general_data()["region"]
+
+        self.face_size = int(self.config.get_download_data()["face_size"])
+        self.mode = self.config.get("Download", "interpolation", fallback="nearest")
+        self.fetch_workers = int(self.config.get("Download", "fetch_workers", fallback="4"))
+        self.reproject_workers = int(self.config.get("Download", "reproject_workers", fallback="0"))
+        self.writer_workers = int(self.config.get("Download", "writer_workers", fallback="2"))
+        self.queue_size = int(self.config.get("Download", "pipeline_queue_size", fallback="8"))
+        self.pyramid_levels = get_pyramid_levels()
+        # "crops" renders the processed crops directly and never writes the panorama itself
+        self.render_mode = self.config.get("Download", "render_mode", fallback="equirect").strip().lower()
+        self.crop_folder = resolve_path(self.config.get_processed_data()["save_folder"])
+        if self.pyramid_levels and self.render_mode == "crops":
+            self.logger.log_status("pyramid_levels is ignored in crops render mode, no panorama is written", "WARNING")
+        # partial-sphere mode: only the equatorial faces are bought and only the latitude band rendered
+        self.latitude_band = get_latitude_band()
+        self.face_names = get_fetch_faces(self.latitude_band)
+        if self.latitude_band is not None:
+            # the crop stage keeps the top of the panorama (from 90° down), which the band leaves black,
+            # and black-banded panoramas or crops would later pass as complete
+            coverage = crop_band_coverage(self.face_size, self.latitude_band)
+            if coverage < 1:
+                raise ValueError(
+                    f"latitude_band ±{self.latitude_band}° covers only {coverage:.0%} of the crop window (90° down to "
+                    f"{crop_top_latitude(self.face_size):.1f}°), the rest of every crop would be black. "
+                    f"Turn partial_sphere off")
+        # (face_size, threshold, faces) when low-resolution faces are scored before the full ones are bought
+        self.prescreen = get_prescreen_settings(self.config)
+        if self.prescreen:
+            rate = break_even(len(self.prescreen[2]), len(self.face_names))
+            if rate >= 1:
+                # screening costs at least as many requests as buying the panorama outright
+                self.logger.log_status(
+                    f"Pre-screen disabled: {len(self.prescreen[2])} screening requests per panorama can never "
+                    f"save money when only {len(self.face_names)} full faces are bought", "WARNING")
+                self.prescreen = None
+            elif self.latitude_band is not None:
+                self.logger.log_status(
+                    f"Pre-screen with partial_sphere: only {len(self.face_names)} full faces per panorama, "
+                    f"so it saves requests only if it rejects more than {rate:.0%} of panoramas", "WARNING")
+
+        self.manifest = DownloadManifest(self.config.get_download_manifest_path(), self.logger)
+
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.done = 0
+        self.saved = 0
+        self.skipped = 0
+        self.total = 0
+        self.cache_only = False
+        # seconds spent per panorama in each stage, for logging and benchmarks/bench_download.py
+        self.timings = {"prescreen": [], "fetch": [], "reproject": [], "write": []}
+
+    def stop(self):
+        """
+        Stop handing out new panoramas; the ones already in flight are finished
+        """
+        self._stop.set()
+
+    def run(self, coords: list[tuple[float, float, str]], max_images: int = None, cache_only: bool = False) -> int:
+        """
+        Download every (lat, lng, pano_id) in coords through the three stages. Blocks until done.
+        cache_only: re-render from the face cache without any API call, e.g. after changing the
+            interpolation, codec or render mode. Panoramas the manifest has as done are rendered
+            again; panoramas whose faces are not all cached are left out.
+        Returns the number of panoramas saved.
+        """
+        self.cache_only = cache_only
+        if cache_only:
+            cached = [job for job in coords if faces_cached(job[2], self.face_size, self.face_names)]
+            if len(cached) < len(coords):
+                self.logger.log_status(
+                    f"Re-render: {len(coords) - len(cached)} panoramas are not fully in the face cache and are left out")
+            coords = cached
+        jobs = self.manifest.plan(coords, self.face_size, self._targets, force=cache_only, latitude_band=self.latitude_band,
+                                  required=self._levels)
+        jobs = jobs[:max_images] if max_images else jobs
+        self.total = len(jobs)
+        self.done = self.saved = self.skipped = 0
+        self.timings = {stage: [] for stage in self.timings}
+        if not jobs:
+            return 0
+
+        job_q = queue.Queue()
+        for job in jobs:
+            job_q.put(job)
+        reproject_q = queue.Queue(maxsize=self.queue_size)
+        write_q = queue.Queue(maxsize=self.queue_size)
+
+        self.logger.log_status(
+            f"Pipeline starting for {self.total} panoramas: fetch={self.fetch_workers}, "
+            f"reproject={self.reproject_workers}, write={self.writer_workers}, queue={self.queue_size}, "
+            f"faces={len(self.face_names)}" + (", from the face cache" if cache_only else "")
+            + (f", latitude band ±{self.latitude_band}°" if self.latitude_band is not None else "")
+            + (f", pre-screen {self.prescreen[0]}px ≥ {self.prescreen[1]} on {'/'.join(self.prescreen[2])} "
+               f"(break-even at {break_even(len(self.prescreen[2]), len(self.face_names)):.0%} rejected)"
+               if self.prescreen and not cache_only else "")
+        )
+
+        # Build/persist the remap table once here so the worker processes only memory-map it
+        get_remap_table(self.face_size)
+        pool = get_process_pool(self.reproject_workers) if self.reproject_workers > 0 else None
+        fetchers = self._start(self.fetch_workers, self._fetch_stage, job_q, reproject_q)
+        reprojectors = self._start(max(self.reproject_workers, 1), self._reproject_stage, reproject_q, write_q, pool)
+        writers = self._start(self.writer_workers, self._write_stage, write_q)
+
+        self._join(fetchers, reproject_q, len(reprojectors))
+        self._join(reprojectors, write_q, len(writers))
+        self._join(writers)
+
+        self.logger.log_status(
+            f"Pipeline finished: {self.saved}/{self.total} panoramas saved"
+            + (f", {self.skipped} rejected by the pre-screen" if self.prescreen else "")
+            + f". {self.stage_summary()}")
+        return self.saved
+
+    def stage_summary(self) -> str:
+        """
+        Mean time per panorama of every stage, e.g. "fetch 812.0 ms, reproject 95.1 ms, write 60.3 ms"
+        """
+        parts = []
+        for stage, values in self.timings.items():
+            mean = sum(values) / len(values) * 1000 if values else 0.0
+            parts.append(f"{stage} {mean:.1f} ms")
+        return ", ".join(parts)
+
+    def _targets(self, job) -> list[str]:
+        """
+        Files this run writes for job: the panorama in save_dir with the current codec,
+        or its crops in crops mode
+        """
+        lat, lng, pano_id = job
+        path = panorama_path(self.save_dir, pano_id, (lat, lng), self.region)
+        if self.render_mode == "crops":
+            return crop_paths(self.crop_folder, path)
+        return [path]
+
+    def _levels(self, job) -> list[str]:
+        """
+        Pyramid level files this run writes for job; a panorama missing any of them is fetched again
+        """
+        if self.render_mode == "crops":
+            return []
+        lat, lng, pano_id = job
+        path = panorama_path(self.save_dir, pano_id, (lat, lng), self.region)
+        return [str(pyramid_level_path(path, size)) for size in self.pyramid_levels]
+
+    # --- stage plumbing ---
+
+    def _record(self, stage: str, started: float):
+        with self._lock:
+            self.timings[stage].append(time.perf_counter() - started)
+
+    def _start(self, count, target, *args) -> list[threading.Thread]:
+        threads = [threading.Thread(target=target, args=args, daemon=True) for _ in range(max(count, 1))]
+        for t in threads:
+            t.start()
+        return threads
+
+    def _join(self, threads, next_q: queue.Queue = None, consumers: int = 0):
+        for t in threads:
+            t.join()
+        for _ in range(consumers):
+            next_q.put(_DONE)
+
+    def _finish(self, job, path=None, error=None, skipped=False):
+        lat, lng, pano_id = job
+        with self._lock:
+            self.done += 1
+            if skipped:
+                self.skipped += 1
+            elif error is None:
+                self.saved += 1
+            done = self.done
+        if skipped:
+            self.manifest.mark_skipped(pano_id, self.face_size)
+        elif error is None:
+            self.manifest.mark_done(pano_id, self.face_size, path, self.latitude_band)
+            self.logger.log_status(f"Saved image {path}")
+        else:
+            self.manifest.mark_failed(pano_id, self.face_size)
+            self.logger.log_exception(f"Failed to download at ({lat},{lng}): {error}")
+        if self.progress:
+            self.progress(done, self.total)
+
+    def _stop_on_quota(self, error: QuotaExceeded):
+        # every later panorama would fail the same way; they stay pending for the next run
+        self.logger.log_status(f"Stopping download: {error}", "WARNING")
+        self._stop.set()
+
+    # --- stages ---
+
+    def _passes_prescreen(self, pano_id: str) -> bool:
+        """
+        Score the panorama from its low-resolution side faces (or the score stored by an
+        earlier run) and compare it with the current threshold
+        """
+        prescreen_size, threshold, names = self.prescreen
+        score = self.manifest.get_score(pano_id, self.face_size)
+        if score is None:
+            started = time.perf_counter()
+            faces = fetch_cube_faces(pano_id, logger=self.logger, FACE_SIZE=prescreen_size, names=names)
+            score = building_score(faces)
+            self.manifest.set_score(pano_id, self.face_size, score)
+            self._record("prescreen", started)
+        return score >= threshold
+
+    def _fetch_stage(self, job_q: queue.Queue, reproject_q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                job = job_q.get_nowait()
+            except queue.Empty:
+                return
+            lat, lng, pano_id = job
+            try:
+                # a re-render has already paid for its faces, there is nothing left to save
+                if self.prescreen and not self.cache_only and not self._passes_prescreen(pano_id):
+                    self._finish(job, skipped=True)
+                    continue
+            except QuotaExceeded as e:
+                self._stop_on_quota(e)
+                return
+            except Exception as e:
+                self._finish(job, error=e)
+                continue
+            started = time.perf_counter()
+            try:
+                faces = fetch_cube_faces(pano_id, logger=self.logger, FACE_SIZE=self.face_size,
+                                         cache_only=self.cache_only, names=self.face_names)
+                stack = stack_faces(faces, self.face_size)
+            except QuotaExceeded as e:
+                self._stop_on_quota(e)
+                return
+            except Exception as e:
+                self._finish(job, error=e)
+                continue
+            self._record("fetch", started)
+            reproject_q.put((job, stack))
+
+    def _reproject_stage(self, reproject_q: queue.Queue, write_q: queue.Queue, pool: ProcessPoolExecutor):
+        while True:
+            item = reproject_q.get()
+            if item is _DONE:
+                return
+            job, stack = item
+            started = time.perf_counter()
+            try:
+                if pool is not None:
+                    image = self._reproject_in_pool(pool, stack)
+                else:
+                    # in-process: spread each panorama over the shared reprojection threads instead
+                    image = reproject_stack(stack, self.mode, self.render_mode, threads=0, latitude_band=self.latitude_band)
+            except Exception as e:
+                self._finish(job, error=e)
+                continue
+            self._record("reproject", started)
+            write_q.put((job, image))
+
+    def _reproject_in_pool(self, pool: ProcessPoolExecutor, stack: np.ndarray):
+        region = output_region(self.face_size, self.render_mode)
+        if region is None:
+            return []
+        row0, row1, col0, col1 = region
+        out_shape = (row1 - row0, col1 - col0, 3)
+        stack_shm = shared_memory.SharedMemory(create=True, size=stack.nbytes)
+        out_shm = shared_memory.SharedMemory(create=True, size=int(np.prod(out_shape)))
+        try:
+            np.ndarray(stack.shape, dtype=np.uint8, buffer=stack_shm.buf)[...] = stack
+            pool.submit(_reproject_shared, stack_shm.name, stack.shape, out_shm.name, out_shape,
+                        self.mode, self.render_mode, self.latitude_band).result()
+            # copied out so the blocks can be released before the write stage
+            image = np.ndarray(out_shape, dtype=np.uint8, buffer=out_shm.buf).copy()
+        finally:
+            for shm in (stack_shm, out_shm):
+                shm.close()
+                shm.unlink()
+        return split_crops(image) if self.render_mode == "crops" else image
+
+    def _write_stage(self, write_q: queue.Queue):
+        while True:
+            item = write_q.get()
+            if item is _DONE:
+                return
+            job, image = item
+            lat, lng, pano_id = job
+            path = panorama_path(self.save_dir, pano_id, (lat, lng), self.region)
+            started = time.perf_counter()
+            try:
+                if self.render_mode == "crops":
+                    written = []
+                    for crop, crop_path in zip(image, crop_paths(self.crop_folder, path, len(image))):
+                        if crop.size:
+                            save_panorama(crop, crop_path)
+                            written.append(crop_path)
+                    if not written:
+                        raise ValueError("Crop geometry lies outside the panorama, nothing to save")
+                    path = written[0]
+                else:
+                    save_panorama(image, path)
+                    save_pyramid(image, path, self.pyramid_levels)
+            except Exception as e:
+                self._finish(job, error=e)
+                continue
+            self._record("write", started)
+            self._finish(job, path=path)
@@ -0,0 +1,140 @@
+# Content-addressed on-disk cache of raw cube faces as returned by the Static API.
+# Entries are keyed by (pano_id, heading, pitch, face_size) and evicted least-recently-used
+# once the cache grows past its size limit, so re-rendering a panorama never re-buys its faces.
+
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+
+from AppLogger import Logger
+from config_ import Config
+from utils import resolve_path
+
+
+class FaceCache:
+    def __init__(self, root, max_bytes: int, logger: Logger):
+        """
+        Args:
+            root (str | Path): Cache folder. Faces live in root/<2 hex>/<sha1>.jpg next to an index.db
+            max_bytes (int): Size limit of the cached faces, 0 disables eviction
+            logger (Logger): App logger
+        """
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        self.conn = sqlite3.connect(str(self.root / "index.db"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS faces (
+                key TEXT PRIMARY KEY,
+                pano_id TEXT, heading INTEGER, pitch INTEGER, face_size INTEGER,
+                bytes INTEGER, last_access REAL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_faces_access ON faces(last_access)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM faces").fetchone()[0]
+
+    @staticmethod
+    def make_key(pano_id: str, heading: int, pitch: int, face_size: int) -> str:
+        return hashlib.sha1(f"{pano_id}|{heading}|{pitch}|{face_size}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.jpg"
+
+    def get(self, pano_id: str, heading: int, pitch: int, face_size: int):
+        """
+        Returns the cached face bytes, or None on a miss
+        """
+        key = self.make_key(pano_id, heading, pitch, face_size)
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            with self.lock:
+                # file went missing behind our back, forget the entry
+                row = self.conn.execute("SELECT bytes FROM faces WHERE key=?", (key,)).fetchone()
+                if row:
+                    self.conn.execute("DELETE FROM faces WHERE key=?", (key,))
+                    self.conn.commit()
+                    self.total_bytes -= row[0]
+            return None
+        with self.lock:
+            self.conn.execute("UPDATE faces SET last_access=? WHERE key=?", (time.time(), key))
+            self.conn.commit()
+        return data
+
+    def put(self, pano_id: str, heading: int, pitch: int, face_size: int, data: bytes):
+        """
+        Store a face and evict the least recently used ones if the cache is over its limit
+        """
+        key = self.make_key(pano_id, heading, pitch, face_size)
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_suffix(f".{threading.get_ident()}.part")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+        with self.lock:
+            row = self.conn.execute("SELECT bytes FROM faces WHERE key=?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO faces(key, pano_id, heading, pitch, face_size, bytes, last_access) VALUES(?,?,?,?,?,?,?)",
+                (key, pano_id, heading, pitch, face_size, len(data), time.time()))
+            self.total_bytes += len(data) - (row[0] if row else 0)
+            self.conn.commit()
+            if self.max_bytes and self.total_bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+
+    def _evict(self, target_bytes: int):
+        # caller holds self.lock
+        evicted = 0
+        cur = self.conn.execute("SELECT key, bytes FROM faces ORDER BY last_access")
+        victims = []
+        for key, size in cur:
+            if self.total_bytes <= target_bytes:
+                break
+            victims.append((key,))
+            self.total_bytes -= size
+            evicted += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+        self.conn.executemany("DELETE FROM faces WHERE key=?", victims)
+        self.conn.commit()
+        self.logger.log_status(f"Face cache evicted {evicted} faces, now {self.total_bytes/1e6:.1f} MB")
+
+    def has_pano(self, pano_id: str, face_size: int, views) -> bool:
+        """
+        True if every (name, heading, pitch) in views is cached for pano_id
+        """
+        keys = [self.make_key(pano_id, h, p, face_size) for _, h, p in views]
+        with self.lock:
+            found = self.conn.execute(
+                f"SELECT COUNT(*) FROM faces WHERE key IN ({','.join('?' * len(keys))})", keys).fetchone()[0]
+        return found == len(keys)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_face_cache(config: Config, logger: Logger):
+    """
+    Process-wide face cache configured from [Download]. Returns None when disabled.
+    """
+    global _cache
+    if not config.get_bool("Download", "face_cache_enabled", fallback=True):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                root = resolve_path(config.get("Download", "face_cache_folder", fallback="cache\\faces"))
+                max_mb = float(config.get("Download", "face_cache_max_mb", fallback="4096"))
+                _cache = FaceCache(root, int(max_mb * 1024 * 1024), logger)
+    return _cache
@@ -1,18 +1,16 @@
 import sys
 import os
+import json
 import sqlite3
-import time
-import threading
 import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tenacity import retry, wait_exponential, stop_after_attempt
+from requests.adapters import HTTPAdapter
+from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_not_exception_type
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QLabel, QLineEdit, QPushButton,
     QProgressBar, QHBoxLayout, QMessageBox, QFileDialog
 )
 from PyQt5.QtCore import QUrl, QTimer, pyqtSignal, QThread
 from PyQt5.QtWebEngineWidgets import QWebEngineView
-import folium
 
 from AppLogger import Logger
 logger = Logger(__name__)
@@ -20,34 +18,17 @@ logger = Logger(__name__)
 from config_ import Config
 config = Config(logger=logger)
 
+from Quota_Manager import get_quota_manager, QuotaExceeded
+from Scan_Engine import ScanEngine
+from Scan_Database import init_scan_db, get_writer_settings, connect
+from Scan_Strategies import get_scan_strategy, get_metadata_radius
+from Scan_Planner import plan_scan, describe_plan
+from Scan_Region import region_from_shape
+from Coverage_Map import write_coverage_page, changed_cells, cells_script
+
 # Settings
-COARSE_SPACING = float(config.get_download_data()["coarse_spacing"])  # ~300m
-FINE_SPACING = float(config.get_download_data()["fine_spacing"])  # ~100m
-RATE_LIMIT_PER_MIN = 30000
 SAVE_DB_DEFAULT = config.get_paths_data()["metadata_database_path"]
 
-class RateLimiter:
-    def __init__(self, max_calls_per_minute):
-        self.max_calls = max_calls_per_minute
-        self.period = 60.0
-        self.allowance = max_calls_per_minute
-        self.last_check = time.time()
-        self.lock = threading.Lock()
-
-    def acquire(self):
-        with self.lock:
-            current = time.time()
-            elapsed = current - self.last_check
-            self.last_check = current
-            self.allowance += elapsed * (self.max_calls / self.period)
-            if self.allowance > self.max_calls:
-                self.allowance = self.max_calls
-            if self.allowance < 1.0:
-                return False 
-            else:
-                self.allowance -= 1
-                return True
-
 class StreetViewDensityScanner(QWidget):
     update_ui_signal = pyqtSignal(bool)
 
@@ -78,8 +59,15 @@ class StreetViewDensityScanner(QWidget):
             row.addWidget(inp)
             layout.addLayout(row)
 
+        # optional shape to scan instead of the whole box, e.g. a shape drawn in ApiWindow
+        self.region_input = QLineEdit()
+        self.region_input.setPlaceholderText(
+            'Region (optional): {"type": "polygon", "coords": [[lat, lng], ...]} or '
+            '{"type": "circle", "coords": [[lat, lng]], "radius": metres}')
+        layout.addWidget(self.region_input)
+
         self.workers_input = QLineEdit()
-        self.workers_input.setPlaceholderText("Max Threads (e.g. 10)")
+        self.workers_input.setPlaceholderText("Requests in flight (e.g. 10)")
         layout.addWidget(self.workers_input)
 
         self.dbfile_input = QLineEdit()
@@ -105,6 +93,8 @@ class StreetViewDensityScanner(QWidget):
         layout.addWidget(self.status_label)
 
         self.map_view = QWebEngineView()
+        self.map_view.loadFinished.connect(self.on_map_loaded)
+        self.map_ready = False
 
         global config
         self.map_file = config.get_download_data()["folder_name"] + f'\{self.city}_map.html'
@@ -118,46 +108,7 @@ class StreetViewDensityScanner(QWidget):
             self.dbfile_input.setText(fname)
 
     def init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS coords (
-                id INTEGER PRIMARY KEY,
-                lat REAL, lon REAL,
-                stage TEXT, scanned INTEGER DEFAULT 0
-            )""")
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS results (
-                coord_id INTEGER, pano_id TEXT,
-                FOREIGN KEY(coord_id) REFERENCES coords(id)
-            )""")
-
-
-        #### Temporary table that stores the http responses recieved when querying for metadata. Making ths as I was getting 
-        #### no "OK" responses
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS responses (
-                coord_id INTEGER, response TEXT
-            )""")
-        
-        conn.commit()
-        conn.close()
-
-    def populate_coarse(self, north, south, east, west):
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM coords")
-        if cur.fetchone()[0] == 0:
-            lat = north; batch = []
-            while lat >= south:
-                lon = west
-                while lon <= east:
-                    batch.append((lat, lon, 'coarse'))
-                    lon += COARSE_SPACING
-                lat -= COARSE_SPACING
-            cur.executemany("INSERT INTO coords(lat, lon, stage) VALUES(?, ?, ?)", batch)
-            conn.commit()
-        conn.close()
+        init_scan_db(self.db_path)
 
     def start_scan(self):
         if self.scanning:
@@ -165,19 +116,48 @@ class StreetViewDensityScanner(QWidget):
 
         try:
             self.api_key = self.api_key_input.text().strip()
-            north = float(self.edge_inputs["North (max lat)"].text())
-            south = float(self.edge_inputs["South (min lat)"].text())
-            east = float(self.edge_inputs["East (max lon)"].text())
-            west = float(self.edge_inputs["West (min lon)"].text())
+            self.region = None
+            if self.region_input.text().strip():
+                # the shape's bounding box replaces the edge inputs
+                self.region = region_from_shape(json.loads(self.region_input.text()))
+                north, south, east, west = self.region.bounds()
+            else:
+                north = float(self.edge_inputs["North (max lat)"].text())
+                south = float(self.edge_inputs["South (min lat)"].text())
+                east = float(self.edge_inputs["East (max lon)"].text())
+                west = float(self.edge_inputs["West (min lon)"].text())
             self.max_workers = int(self.workers_input.text() or 5)
             self.db_path = self.dbfile_input.text().strip() or SAVE_DB_DEFAULT
-        except ValueError:
-            QMessageBox.critical(self, "Error", "Invalid input values")
+        except (ValueError, TypeError) as e:
+            QMessageBox.critical(self, "Error", f"Invalid input values: {e}")
             return
 
+        try:
+            self.strategy = get_scan_strategy(config)
+        except ValueError as e:
+            QMessageBox.critical(self, "Error", str(e))
+            return
         self.init_db()
-        self.populate_coarse(north, south, east, west)
-        self.rate_limiter = RateLimiter(RATE_LIMIT_PER_MIN)
+        # the scan strategy ([Scanner] strategy) lays its seed grid over these bounds; the engine
+        # walks it lazily, so nothing is written before the first probe
+        self.bounds = (north, south, east, west)
+        self.radius = get_metadata_radius(config)
+        self.prune = config.get_bool("Scanner", "prune_known_panos", fallback=True)
+        # planned on the scan thread, a country-sized region takes a while to plan
+        self.plan = None
+        self.engine = None
+        self.status_label.setText("Planning scan...")
+        # the coverage page is written once per scan; refresh_map only pushes changed cells to it
+        self.map_ready = False
+        write_coverage_page(self.map_file, ((north + south) / 2, (east + west) / 2))
+        self.map_view.load(QUrl.fromLocalFile(os.path.abspath(self.map_file)))
+        # rate limit and daily budget are shared with the panorama downloader ([Quota] section)
+        self.quota = get_quota_manager(config, logger)
+        # one pooled session for all engine threads, so connections are reused across requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.scanning = True
 
         self.timer = QTimer(self)
@@ -190,21 +170,20 @@ class StreetViewDensityScanner(QWidget):
         self.thread.start()
 
     def scan_loop(widget):
-        while True:
-            conn = sqlite3.connect(widget.db_path)
-            cur = conn.cursor()
-            cur.execute("SELECT id,lat,lon,stage FROM coords WHERE scanned=0 ORDER BY stage DESC LIMIT ?", (widget.max_workers * 2,))
-            batch = cur.fetchall()
-            conn.close()
-            if not batch:
-                break
-
-            with ThreadPoolExecutor(max_workers=widget.max_workers) as ex:
-                for cid, lat, lon, stage in batch:
-                    ex.submit(widget.fetch_and_store, cid, lat, lon, stage)
-
-            # update UI after batch
-            widget.update_ui_signal.emit(False)
+        conn = connect(widget.db_path)
+        widget.plan = plan_scan(conn, widget.strategy.seed_grid(*widget.bounds),
+                                widget.radius if widget.prune else 0, widget.region)
+        conn.close()
+        logger.log_status(f"Scan plan: {describe_plan(widget.plan)}")
+        widget.update_ui_signal.emit(False)
+
+        # max_workers requests stay in flight; the QTimer keeps refreshing the UI meanwhile
+        widget.engine = ScanEngine(widget.db_path, widget.fetch_metadata, logger,
+                                   concurrency=widget.max_workers, strategy=widget.strategy, bounds=widget.bounds,
+                                   plan=widget.plan, region=widget.region,
+                                   writer_settings=get_writer_settings(config),
+                                   call_budget=int(config.get("Scanner", "call_budget", fallback="0")))
+        widget.engine.run()
 
         widget.scanning = False
         widget.update_ui_signal.emit(True)
@@ -213,11 +192,15 @@ class StreetViewDensityScanner(QWidget):
     def update_status_ui(self, final):
         conn = sqlite3.connect(self.db_path)
         cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM coords")
-        total = cur.fetchone()[0]
-        cur.execute("SELECT COUNT(*) FROM coords WHERE scanned=1")
-        done = cur.fetchone()[0]
-        self.status_label.setText(f"Scanned {done}/{total}")
+        # the coverage cells already hold the counts, summing them avoids a scan of coords
+        cur.execute("SELECT COALESCE(SUM(total), 0), COALESCE(SUM(scanned), 0) FROM coverage_cells")
+        total, done = cur.fetchone()
+        # seed points not reached yet have no coords row
+        engine = getattr(self, "engine", None)
+        total += engine.seeds_left() if engine else 0
+        plan = getattr(self, "plan", None)
+        planned = f", {'about ' if plan.estimated else ''}{plan.expected_calls} metadata calls planned" if plan else ""
+        self.status_label.setText(f"Scanned {done}/{total}{planned}")
         self.progress_bar.setMaximum(total)
         self.progress_bar.setValue(done)
 
@@ -233,57 +216,39 @@ class StreetViewDensityScanner(QWidget):
             self.timer.stop()
             self.status_label.setText("Scan completed")
 
-    @retry(wait=wait_exponential(multiplier=1, min=2, max=10), stop=stop_after_attempt(3))
+    @retry(wait=wait_exponential(multiplier=1, min=2, max=10), stop=stop_after_attempt(3),
+           retry=retry_if_not_exception_type(QuotaExceeded))
     def safe_get(self, lat, lon):
-        return requests.get(
-            "https://maps.googleapis.com/maps/api/streetview/metadata",
-            params={"location": f"{lat},{lon}", "key": self.api_key}, timeout=10
+        self.quota.acquire("metadata")
+        resp = self.session.get(
+            f"{config.get_streetview_base_url()}/metadata",
+            params={"location": f"{lat},{lon}", "radius": self.radius, "key": self.api_key}, timeout=10
         )
+        self.quota.on_response("metadata", resp)
+        if resp.status_code == 429:
+            resp.raise_for_status()
+        return resp
     
-    def fetch_and_store(self, coord_id, lat, lon, stage):
-        while not self.rate_limiter.acquire():
-            time.sleep(0.1)  # backoff or yield
-        
-        data = self.safe_get(lat=lat, lon=lon).json()
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
-        cur.execute("UPDATE coords SET scanned=1 WHERE id=?", (coord_id,))
-        print("Got to before data.get")
-        if data.get("status")=="OK":
-            print("Found one atleast")
-            cur.execute("INSERT INTO results(coord_id,pano_id) VALUES(?,?)", (coord_id, data.get("pano_id")))
-            if stage=='coarse':
-                for dlat in (-FINE_SPACING, 0, FINE_SPACING):
-                    for dlon in (-FINE_SPACING, 0, FINE_SPACING):
-                        if dlat==0 and dlon==0: continue
-                        cur.execute("INSERT INTO coords(lat,lon,stage) VALUES(?,?,?)", (lat+dlat, lon+dlon, 'fine'))
-                        print("Found one in fine")
-        
-        cur.execute("INSERT INTO responses(coord_id,response) VALUES(?,?)", (coord_id, data.get("status")))
-        
-        conn.commit()
-        conn.close()
+    def fetch_metadata(self, lat, lon) -> dict:
+        """
+        Metadata json for one coordinate, called from the scan engine's worker threads
+        """
+        return self.safe_get(lat=lat, lon=lon).json()
+
+    def on_map_loaded(self, ok):
+        # a freshly loaded page has no cells yet, so the next refresh sends all of them
+        self.map_ready = ok
+        self.coverage_version = 0
 
     def refresh_map(self):
+        if not self.map_ready:
+            return
         conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
-        cur.execute("SELECT lat,lon,stage,scanned FROM coords")
-        records = cur.fetchall()
+        cells, version = changed_cells(conn, self.coverage_version)
         conn.close()
-
-        if not records: 
-            return
-        
-        avg_lat = sum(r[0] for r in records)/len(records)
-        avg_lon = sum(r[1] for r in records)/len(records)
-        m = folium.Map(location=(avg_lat, avg_lon), zoom_start=13)
-
-        for lat, lon, stage, scanned in records:
-            color = 'green' if (scanned and stage=='coarse') else 'blue' if (scanned and stage=='fine') else 'gray'
-            folium.CircleMarker((lat, lon), radius=3, color=color, fill=True).add_to(m)
-        
-        m.save(self.map_file)
-        self.map_view.load(QUrl.fromLocalFile(os.path.abspath(self.map_file)))
+        if cells:
+            self.map_view.page().runJavaScript(cells_script(cells))
+        self.coverage_version = version
 
 if __name__=='__main__':
     app = QApplication(sys.argv)
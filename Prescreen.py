@@ -0,0 +1,94 @@
+# Cheap building-presence pre-screen run on low-resolution equatorial faces before a panorama's
+# full-resolution faces are bought. The scorer is a few numpy passes (no model weights, no GPU):
+#   - man-made structure shows up as long, axis-aligned edges (pitch 0 faces keep verticals vertical)
+#   - foliage and fields give short edges in every direction and a lot of excess green
+# It is deliberately conservative; scores are stored in the download manifest so the threshold
+# can be re-tuned later without refetching anything.
+# Cost: the Static API bills per request whatever the image size, so screening with k faces before
+# buying F full faces only saves money when more than k / F of the panoramas are rejected
+# (1/3 for two side faces and all six full faces, 1/2 with partial_sphere's four).
+
+import numpy as np
+from PIL import Image
+
+from config_ import Config
+
+# Gradient (0-1 intensity per pixel step) above which a pixel counts as an edge
+EDGE_THRESHOLD = 0.08
+# An edge is axis-aligned when one gradient component is this many times the other
+ALIGN_RATIO = 3.0
+# Share of aligned edges expected from isotropic texture (gradient angle within ~18° of an axis)
+ISOTROPIC_ALIGNMENT = 0.4
+# A column holds a "long vertical" when this share of its rows are vertical edges
+VERTICAL_RUN = 0.15
+# Edge density (share of edge pixels) a face needs for its structure to count in full;
+# a bare horizon or kerb line is aligned but far too sparse
+EDGE_DENSITY = 0.05
+# Excess green (G - max(R, B)) marking a pixel as vegetation
+GREEN_MARGIN = 0.04
+# Faces the pre-screen may score (pitch 0, so verticals stay vertical)
+SCREEN_FACES = ("front", "right", "back", "left")
+
+
+def face_score(image) -> float:
+    """
+    Building-presence score in [0, 1] for one face (PIL Image or RGB array)
+    """
+    if isinstance(image, Image.Image):
+        image = image.convert("RGB")
+    rgb = np.asarray(image, dtype=np.float32) / 255.0
+    gray = rgb.mean(axis=2)
+
+    # forward differences, trimmed to a common (H-1, W-1) grid
+    gx = np.abs(np.diff(gray, axis=1))[:-1]
+    gy = np.abs(np.diff(gray, axis=0))[:, :-1]
+    strong = (gx + gy) > EDGE_THRESHOLD
+    edges = int(strong.sum())
+    if edges == 0:
+        return 0.0
+
+    vertical = strong & (gx > ALIGN_RATIO * gy)
+    horizontal = strong & (gy > ALIGN_RATIO * gx)
+    alignment = (int(vertical.sum()) + int(horizontal.sum())) / edges
+    alignment = np.clip((alignment - ISOTROPIC_ALIGNMENT) / (1 - ISOTROPIC_ALIGNMENT), 0, 1)
+    long_verticals = float((vertical.mean(axis=0) > VERTICAL_RUN).mean())
+
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    vegetation = float(((g - np.maximum(r, b)) > GREEN_MARGIN).mean())
+
+    structure = 0.6 * alignment + 0.4 * min(1.0, long_verticals * 4)
+    structure *= min(1.0, edges / strong.size / EDGE_DENSITY)
+    return float(np.clip(structure * (1 - vegetation), 0, 1))
+
+
+def building_score(faces: dict) -> float:
+    """
+    Score of a panorama from any subset of its faces: the best face wins,
+    one side of the street with buildings is enough
+    """
+    return max((face_score(img) for img in faces.values()), default=0.0)
+
+
+def break_even(screen_calls: int, full_calls: int) -> float:
+    """
+    Share of panoramas the pre-screen has to reject before it saves requests
+    """
+    return screen_calls / full_calls
+
+
+def get_prescreen_settings(config: Config):
+    """
+    (face_size, threshold, faces) of the pre-screen from [Download], or None when it is disabled.
+    faces are the equatorial faces scored, by default the two sides ("right,left"), where the
+    buildings along a street are.
+    """
+    if not config.get_bool("Download", "prescreen", fallback=False):
+        return None
+    face_size = int(config.get("Download", "prescreen_face_size", fallback="128"))
+    threshold = float(config.get("Download", "prescreen_threshold", fallback="0.25"))
+    faces = tuple(name.strip().lower() for name in
+                  config.get("Download", "prescreen_faces", fallback="right,left").split(",") if name.strip())
+    unknown = [name for name in faces if name not in SCREEN_FACES]
+    if not faces or unknown:
+        raise ValueError(f"prescreen_faces must name some of {SCREEN_FACES}, got {faces}")
+    return face_size, threshold, faces
@@ -0,0 +1,215 @@
+# Process-wide API quota service shared by the metadata scanners and the panorama downloader.
+# One token bucket per endpoint paces requests to the allowed rate, a 429 / Retry-After pauses
+# that endpoint for everyone, and a persisted daily budget stops work before the quota runs out.
+
+import json
+import time
+import atexit
+import threading
+import requests
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+from pytz import timezone
+
+from AppLogger import Logger
+from config_ import Config
+from utils import resolve_path
+
+# Google Maps Platform daily quotas reset at midnight Pacific Time
+QUOTA_TIMEZONE = timezone("America/Los_Angeles")
+ENDPOINTS = ("metadata", "streetview")
+
+
+class QuotaExceeded(Exception):
+    """Raised when an endpoint's daily budget is used up"""
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, burst: float = None):
+        """
+        Args:
+            rate_per_minute (float): Sustained requests per minute, 0 (or less) means unlimited
+            burst (float): Bucket size, defaults to one second worth of requests (at least 1)
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.paused_until = 0.0
+        self.cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self):
+        """
+        Take one token, sleeping exactly until one is available (or the pause has passed)
+        """
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    self.cond.wait(self.paused_until - now)
+                    continue
+                # unlimited buckets only hold callers during a pause
+                if self.rate <= 0:
+                    return
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                self.cond.wait((1.0 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """
+        Hold every caller for the given number of seconds and drain the bucket, e.g. after a 429
+        """
+        with self.cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+            self.cond.notify_all()
+
+
+class DailyBudget:
+    def __init__(self, limits: dict[str, int], usage_file, logger: Logger, save_every: int = 50):
+        """
+        Args:
+            limits (dict): Daily request budget per endpoint, 0 means unlimited
+            usage_file (str): JSON file the day's usage is persisted to
+            save_every (int): Persist after this many requests (always persisted on exit)
+        """
+        self.limits = limits
+        self.usage_file = usage_file
+        self.logger = logger
+        self.save_every = save_every
+        self.lock = threading.Lock()
+        self.day, self.used = self._today(), {}
+        self._unsaved = 0
+        self._load()
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.now(QUOTA_TIMEZONE).strftime("%Y-%m-%d")
+
+    def _load(self):
+        try:
+            with open(self.usage_file, "r") as f:
+                data = json.load(f)
+            if data.get("day") == self.day:
+                self.used = {k: int(v) for k, v in data.get("used", {}).items()}
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        # caller holds self.lock
+        try:
+            with open(self.usage_file, "w") as f:
+                json.dump({"day": self.day, "used": self.used}, f, indent=2)
+            self._unsaved = 0
+        except OSError as e:
+            self.logger.log_exception(f"Could not save quota usage: {e}")
+
+    def consume(self, endpoint: str):
+        with self.lock:
+            today = self._today()
+            if today != self.day:
+                self.day, self.used = today, {}
+            limit = self.limits.get(endpoint, 0)
+            used = self.used.get(endpoint, 0)
+            if limit and used >= limit:
+                raise QuotaExceeded(f"Daily budget of {limit} {endpoint} requests reached")
+            self.used[endpoint] = used + 1
+            self._unsaved += 1
+            if self._unsaved >= self.save_every:
+                self._save()
+
+    def remaining(self, endpoint: str):
+        """
+        Requests left today, or None when the endpoint has no budget
+        """
+        with self.lock:
+            limit = self.limits.get(endpoint, 0)
+            if not limit:
+                return None
+            used = self.used.get(endpoint, 0) if self.day == self._today() else 0
+            return max(0, limit - used)
+
+
+class QuotaManager:
+    def __init__(self, config: Config, logger: Logger):
+        """
+        Builds one token bucket and budget per endpoint from the [Quota] section
+        """
+        self.logger = logger
+        settings = config.get_quota_data() or {}
+        self.buckets = {
+            name: TokenBucket(float(settings.get(f"{name}_per_minute", 30000)))
+            for name in ENDPOINTS
+        }
+        limits = {name: int(settings.get(f"{name}_daily_budget", 0)) for name in ENDPOINTS}
+        self.budget = DailyBudget(limits, resolve_path(settings.get("usage_file", "quota_usage.json")), logger)
+        atexit.register(self.budget.save)
+
+    def acquire(self, endpoint: str):
+        """
+        Block until a request to endpoint is allowed. Raises QuotaExceeded when today's budget is spent.
+        """
+        self.budget.consume(endpoint)
+        self.buckets[endpoint].acquire()
+
+    def on_response(self, endpoint: str, response):
+        """
+        Feed a response back; a 429 pauses the endpoint for its Retry-After (or 10 s)
+        """
+        if response is None or response.status_code != 429:
+            return
+        delay = parse_retry_after(response.headers.get("Retry-After"), default=10.0)
+        self.logger.log_status(f"429 from {endpoint}, pausing requests for {delay:.1f}s", "WARNING")
+        self.buckets[endpoint].pause(delay)
+
+
+def retry_if_rate_limited(exception):
+    """Return True if exception is HTTPError with status 429."""
+    return (
+        isinstance(exception, requests.exceptions.HTTPError)
+        and exception.response is not None
+        and exception.response.status_code == 429
+    )
+
+
+def parse_retry_after(value, default: float) -> float:
+    """
+    Seconds to wait from a Retry-After header given either as seconds or as an HTTP date
+    """
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_quota_manager(config: Config, logger: Logger) -> QuotaManager:
+    """
+    The process-wide quota manager, created on first use
+    """
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = QuotaManager(config, logger)
+    return _manager
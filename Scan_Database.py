@@ -0,0 +1,471 @@
+# Metadata scan database: schema and the single writer that stores scan results.
+# Every result goes through one ScanWriter thread, which applies them in batched transactions
+# (executemany, WAL journal), so the scan threads never contend for the database lock and the
+# number of fsyncs is set by the batch size instead of the request rate.
+# The schema is versioned with PRAGMA user_version; migrate_scan_db brings older databases
+# (e.g. the ones in Metadata_Maps) up to date and is safe to run any number of times.
+#   1: R*Tree spatial index over coords, work-queue index on (scanned, stage), results(coord_id) index
+#   2: integer lattice keys (ilat, ilon) with a UNIQUE index, duplicate coordinates merged
+#   3: scan_state key/value table (virtual seed grid cursor)
+#   4: panos table, one row per unique panorama (location, capture date, hit count)
+#   5: coverage_cells aggregates per COVERAGE_CELL square, kept up to date by triggers
+
+import os
+import sys
+import glob
+import time
+import queue
+import sqlite3
+import threading
+from collections import namedtuple
+
+from AppLogger import Logger
+from config_ import Config
+from utils import resolve_path
+
+# new_points: (ilat, ilon, stage) of the coordinates the scan strategy queues because of this result
+# point:      (ilat, ilon, stage) of a seed grid point that has no coords row yet (coord_id is None)
+# cursor:     seed grid cursor to store with this result
+# pano:       (lat, lon, date) of the panorama from the metadata response, None without a hit
+# A result with status None records a failed seed point as unscanned so the next run retries it.
+ScanResult = namedtuple("ScanResult", ["coord_id", "status", "pano_id", "new_points", "point", "cursor", "pano"])
+
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL")
+SCHEMA_VERSION = 5
+SEED_CURSOR = "seed_cursor"
+
+# Coordinates are keyed by fixed-point degrees (1e-7° ≈ 1 cm). Grid points are generated in these
+# integers, so the same point always gets the same key no matter how it was reached.
+LATTICE_SCALE = 10_000_000
+
+
+def to_lattice(lat: float, lon: float) -> tuple[int, int]:
+    return round(lat * LATTICE_SCALE), round(lon * LATTICE_SCALE)
+
+
+def from_lattice(ilat: int, ilon: int) -> tuple[float, float]:
+    return ilat / LATTICE_SCALE, ilon / LATTICE_SCALE
+
+
+def lattice_step(spacing: float) -> int:
+    """
+    A grid spacing in degrees as a lattice step
+    """
+    return max(round(spacing * LATTICE_SCALE), 1)
+
+
+# Side of a coverage map cell in lattice units (0.002°, about 220 m)
+COVERAGE_CELL = 20_000
+
+# Marks the end of the writer's input
+_CLOSE = object()
+
+
+def connect(db_path, synchronous: str = "NORMAL") -> sqlite3.Connection:
+    """
+    Connection to the scan database in WAL mode, so readers (UI, scan engine) never block the writer.
+    synchronous=NORMAL only fsyncs at checkpoints in WAL mode: a power cut can lose the last
+    commits but never corrupts the database. FULL fsyncs every commit.
+    """
+    synchronous = synchronous.upper()
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f"synchronous must be one of {SYNCHRONOUS_MODES}, got {synchronous}")
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    return conn
+
+
+def init_scan_db(db_path):
+    conn = connect(db_path)
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS coords (
+            id INTEGER PRIMARY KEY,
+            lat REAL, lon REAL,
+            stage TEXT, scanned INTEGER DEFAULT 0
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS results (
+            coord_id INTEGER, pano_id TEXT,
+            FOREIGN KEY(coord_id) REFERENCES coords(id)
+        )""")
+
+    #### Temporary table that stores the http responses recieved when querying for metadata. Making ths as I was getting
+    #### no "OK" responses
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS responses (
+            coord_id INTEGER, response TEXT
+        )""")
+
+    conn.commit()
+    migrate_scan_db(conn)
+    conn.close()
+
+
+def has_rtree(conn: sqlite3.Connection) -> bool:
+    """
+    True when the database has the coords_rtree spatial index
+    """
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name='coords_rtree'").fetchone() is not None
+
+
+def _migrate_spatial_index(conn: sqlite3.Connection):
+    # next-batch claiming: WHERE scanned=0 ORDER BY stage DESC
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_coords_queue ON coords(scanned, stage)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_results_coord ON results(coord_id)")
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS coords_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+    except sqlite3.OperationalError:
+        # SQLite built without the R*Tree module: a plain (lat, lon) index still bounds the latitude range
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_coords_latlon ON coords(lat, lon)")
+        return
+    # the triggers keep the index in step with every writer of coords (ScanWriter, migrations, ...)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS coords_rtree_insert AFTER INSERT ON coords BEGIN
+            INSERT OR REPLACE INTO coords_rtree VALUES (new.id, new.lat, new.lat, new.lon, new.lon);
+        END""")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS coords_rtree_update AFTER UPDATE OF lat, lon ON coords BEGIN
+            UPDATE coords_rtree SET min_lat=new.lat, max_lat=new.lat, min_lon=new.lon, max_lon=new.lon WHERE id=new.id;
+        END""")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS coords_rtree_delete AFTER DELETE ON coords BEGIN
+            DELETE FROM coords_rtree WHERE id=old.id;
+        END""")
+    conn.execute("INSERT OR REPLACE INTO coords_rtree SELECT id, lat, lat, lon, lon FROM coords")
+
+
+def _migrate_lattice_keys(conn: sqlite3.Connection):
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(coords)")}
+    for column in ("ilat", "ilon"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE coords ADD COLUMN {column} INTEGER")
+    conn.execute(f"UPDATE coords SET ilat=CAST(round(lat*{LATTICE_SCALE}) AS INTEGER), ilon=CAST(round(lon*{LATTICE_SCALE}) AS INTEGER)")
+    # snap the floats onto their key so lat/lon compare equal wherever the same point appears
+    conn.execute(f"UPDATE coords SET lat=ilat/{LATTICE_SCALE}.0, lon=ilon/{LATTICE_SCALE}.0")
+
+    # merge duplicates into one row per key, keeping a scanned row if there is one
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_coords_lattice_merge ON coords(ilat, ilon, scanned DESC, id)")
+    conn.execute("DROP TABLE IF EXISTS temp.coord_merge")
+    conn.execute("CREATE TEMP TABLE coord_merge (id INTEGER PRIMARY KEY, keep_id INTEGER)")
+    conn.execute("""
+        INSERT INTO coord_merge
+        SELECT id, keep_id FROM (
+            SELECT id, first_value(id) OVER (PARTITION BY ilat, ilon ORDER BY scanned DESC, id) AS keep_id FROM coords
+        ) WHERE id != keep_id""")
+    for table in ("results", "responses"):
+        conn.execute(f"""
+            UPDATE {table} SET coord_id=(SELECT keep_id FROM coord_merge WHERE coord_merge.id={table}.coord_id)
+            WHERE coord_id IN (SELECT id FROM coord_merge)""")
+    conn.execute("DELETE FROM coords WHERE id IN (SELECT id FROM coord_merge)")
+    conn.execute("DELETE FROM results WHERE rowid NOT IN (SELECT MIN(rowid) FROM results GROUP BY coord_id, pano_id)")
+    conn.execute("DROP TABLE coord_merge")
+    conn.execute("DROP INDEX idx_coords_lattice_merge")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_coords_lattice ON coords(ilat, ilon)")
+
+
+def _migrate_scan_state(conn: sqlite3.Connection):
+    conn.execute("CREATE TABLE IF NOT EXISTS scan_state (key TEXT PRIMARY KEY, value TEXT)")
+
+
+def _migrate_panos(conn: sqlite3.Connection):
+    # lat/lon is where the panorama is, coord_id the scan point that found it first
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS panos (
+            pano_id TEXT PRIMARY KEY,
+            lat REAL, lon REAL, date TEXT,
+            coord_id INTEGER, hits INTEGER NOT NULL DEFAULT 1
+        )""")
+    # older scans never stored the panorama's own location or date: use its first scan point
+    # instead (with MIN() SQLite takes the bare columns from the row holding the minimum)
+    conn.execute("""
+        INSERT OR IGNORE INTO panos(pano_id, lat, lon, coord_id, hits)
+        SELECT pano_id, lat, lon, coord_id, hits FROM (
+            SELECT r.pano_id, c.lat, c.lon, r.coord_id, MIN(r.rowid), COUNT(*) AS hits
+            FROM results r JOIN coords c ON c.id = r.coord_id
+            GROUP BY r.pano_id
+        )""")
+
+
+def _cell_key(column: str) -> str:
+    # floor division on the lattice key (SQLite's / truncates towards zero)
+    return f"(({column} - (({column} % {COVERAGE_CELL}) + {COVERAGE_CELL}) % {COVERAGE_CELL}) / {COVERAGE_CELL})"
+
+
+def _migrate_coverage_cells(conn: sqlite3.Connection):
+    # version grows with every change, so a reader asks for the cells changed since the last version it saw
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS coverage_cells (
+            cell_lat INTEGER, cell_lon INTEGER,
+            total INTEGER NOT NULL DEFAULT 0, scanned INTEGER NOT NULL DEFAULT 0, hits INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL,
+            PRIMARY KEY (cell_lat, cell_lon)
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_coverage_version ON coverage_cells(version)")
+    next_version = "(SELECT COALESCE(MAX(version), 0) + 1 FROM coverage_cells)"
+    cell_lat, cell_lon = _cell_key("new.ilat"), _cell_key("new.ilon")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS coverage_insert AFTER INSERT ON coords BEGIN
+            INSERT INTO coverage_cells(cell_lat, cell_lon, total, scanned, version)
+            VALUES ({cell_lat}, {cell_lon}, 1, new.scanned, {next_version})
+            ON CONFLICT(cell_lat, cell_lon) DO UPDATE SET
+                total=total+1, scanned=scanned+excluded.scanned, version=excluded.version;
+        END""")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS coverage_scanned AFTER UPDATE OF scanned ON coords
+        WHEN new.scanned != old.scanned BEGIN
+            UPDATE coverage_cells SET scanned=scanned+new.scanned-old.scanned, version={next_version}
+            WHERE cell_lat={cell_lat} AND cell_lon={cell_lon};
+        END""")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS coverage_delete AFTER DELETE ON coords BEGIN
+            UPDATE coverage_cells SET total=total-1, scanned=scanned-old.scanned, version={next_version}
+            WHERE cell_lat={_cell_key("old.ilat")} AND cell_lon={_cell_key("old.ilon")};
+        END""")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS coverage_hit AFTER INSERT ON results BEGIN
+            UPDATE coverage_cells SET hits=hits+1, version={next_version}
+            WHERE (cell_lat, cell_lon) = (
+                SELECT {_cell_key("ilat")}, {_cell_key("ilon")} FROM coords WHERE id=new.coord_id);
+        END""")
+    conn.execute("DELETE FROM coverage_cells")
+    conn.execute(f"""
+        INSERT INTO coverage_cells(cell_lat, cell_lon, total, scanned, hits, version)
+        SELECT {_cell_key("c.ilat")}, {_cell_key("c.ilon")}, COUNT(*), SUM(c.scanned),
+               SUM((SELECT COUNT(*) FROM results r WHERE r.coord_id = c.id)), 1
+        FROM coords c GROUP BY 1, 2""")
+
+
+# user_version → migration that brings the schema to that version
+MIGRATIONS = {
+    1: _migrate_spatial_index,
+    2: _migrate_lattice_keys,
+    3: _migrate_scan_state,
+    4: _migrate_panos,
+    5: _migrate_coverage_cells,
+}
+
+
+def get_state(conn: sqlite3.Connection, key: str):
+    row = conn.execute("SELECT value FROM scan_state WHERE key=?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_state(conn: sqlite3.Connection, key: str, value):
+    conn.execute("INSERT OR REPLACE INTO scan_state(key, value) VALUES(?,?)", (key, str(value)))
+
+
+def migrate_scan_db(conn: sqlite3.Connection) -> int:
+    """
+    Apply the migrations newer than the database's user_version, each in its own transaction.
+    Returns the schema version the database ends up at.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target in sorted(MIGRATIONS):
+        if target <= version:
+            continue
+        with conn:
+            MIGRATIONS[target](conn)
+            conn.execute(f"PRAGMA user_version={target}")
+        version = target
+    return version
+
+
+def query_results(conn: sqlite3.Connection, north, south, east, west, region=None) -> list[tuple]:
+    """
+    (lat, lon, pano_id) of every panorama found inside the rectangle, once per panorama
+    (at the first scan point inside the rectangle that found it).
+    The R*Tree stores float32 bounds rounded outwards, so its hits are re-checked on the exact columns.
+    region: Scan_Region shape inside the rectangle; scan points outside it are dropped
+    """
+    if has_rtree(conn):
+        query = """
+            SELECT c.lat, c.lon, r.pano_id
+            FROM coords_rtree t
+            JOIN coords c ON c.id = t.id
+            JOIN results r ON c.id = r.coord_id
+            WHERE t.min_lat <= ? AND t.max_lat >= ? AND t.min_lon <= ? AND t.max_lon >= ?
+              AND c.lat <= ? AND c.lat >= ? AND c.lon <= ? AND c.lon >= ?
+            ORDER BY c.id
+        """
+        rows = conn.execute(query, (north, south, east, west) * 2).fetchall()
+    else:
+        query = """
+            SELECT c.lat, c.lon, r.pano_id
+            FROM coords c
+            JOIN results r ON c.id = r.coord_id
+            WHERE c.lat <= ? AND c.lat >= ? AND c.lon <= ? AND c.lon >= ?
+            ORDER BY c.id
+        """
+        rows = conn.execute(query, (north, south, east, west)).fetchall()
+    if region is not None and rows:
+        lat, lon, _ = zip(*rows)
+        rows = [row for row, keep in zip(rows, region.contains(lat, lon).tolist()) if keep]
+    # a panorama found from several scan points is returned once
+    seen = set()
+    unique = []
+    for row in rows:
+        if row[2] not in seen:
+            seen.add(row[2])
+            unique.append(row)
+    return unique
+
+
+def migrate_folder(folder="Metadata_Maps", logger: Logger = None) -> dict[str, int]:
+    """
+    Migrate every scan database in folder. Returns {path: schema version}.
+    """
+    versions = {}
+    for path in sorted(glob.glob(os.path.join(resolve_path(folder), "*.db"))):
+        conn = connect(path)
+        try:
+            versions[path] = migrate_scan_db(conn)
+        except sqlite3.DatabaseError as e:
+            if logger:
+                logger.log_exception(f"Could not migrate {path}: {e}")
+        finally:
+            conn.close()
+    return versions
+
+
+def get_writer_settings(config: Config) -> dict:
+    """
+    ScanWriter keyword arguments from the [Scanner] section
+    """
+    return {
+        "batch_size": int(config.get("Scanner", "writer_batch_size", fallback="500")),
+        "flush_interval": float(config.get("Scanner", "writer_flush_seconds", fallback="1.0")),
+        "synchronous": config.get("Scanner", "writer_synchronous", fallback="NORMAL"),
+    }
+
+
+class ScanWriter:
+    def __init__(self, db_path, logger: Logger, batch_size: int = 500, flush_interval: float = 1.0,
+                 synchronous: str = "NORMAL", on_commit=None):
+        """
+        Args:
+            db_path (str): Scan database
+            logger (Logger): App logger
+            batch_size (int): Results per transaction
+            flush_interval (float): Seconds a result may wait before its batch is committed anyway
+            synchronous (str): SQLite synchronous mode, OFF / NORMAL / FULL
+            on_commit (callable): Called from the writer thread with the coord ids of every committed batch
+        """
+        self.db_path = db_path
+        self.logger = logger
+        self.batch_size = max(int(batch_size), 1)
+        self.flush_interval = flush_interval
+        self.synchronous = synchronous
+        self.on_commit = on_commit
+
+        self.written = 0
+        self.commits = 0
+        self.queue = queue.Queue()
+        # opened here so a bad path or synchronous mode fails in the caller, not in the thread
+        connect(self.db_path, self.synchronous).close()
+        self.thread = threading.Thread(target=self._run, name="scan-writer", daemon=True)
+        self.thread.start()
+
+    def put(self, result: ScanResult):
+        self.queue.put(result)
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Block until every result put so far is committed. Returns False on timeout.
+        """
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """
+        Commit what is queued and stop the writer thread
+        """
+        self.queue.put(_CLOSE)
+        self.thread.join()
+
+    def _run(self):
+        self.conn = connect(self.db_path, self.synchronous)
+        batch = []
+        deadline = None
+        try:
+            while True:
+                timeout = max(deadline - time.monotonic(), 0) if batch else None
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None  # flush_interval elapsed
+
+                if isinstance(item, ScanResult):
+                    if not batch:
+                        deadline = time.monotonic() + self.flush_interval
+                    batch.append(item)
+                    if len(batch) < self.batch_size:
+                        continue
+
+                self._write(batch)
+                batch = []
+                if isinstance(item, threading.Event):
+                    item.set()
+                elif item is _CLOSE:
+                    return
+        finally:
+            self.conn.close()
+
+    def _write(self, batch: list[ScanResult]):
+        if not batch:
+            return
+        try:
+            with self.conn:
+                # seed grid points get their coords row now that they have been probed
+                seeds = [r for r in batch if r.point is not None]
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO coords(lat,lon,ilat,ilon,stage) VALUES(?,?,?,?,?)",
+                    [(*from_lattice(ilat, ilon), ilat, ilon, stage) for ilat, ilon, stage in (r.point for r in seeds)])
+                ids = {
+                    r.point: self.conn.execute(
+                        "SELECT id FROM coords WHERE ilat=? AND ilon=?", r.point[:2]).fetchone()[0]
+                    for r in seeds
+                }
+                cursors = [r.cursor for r in batch if r.cursor is not None]
+                if cursors:
+                    set_state(self.conn, SEED_CURSOR, max(cursors))
+                batch = [r._replace(coord_id=ids[r.point]) if r.point is not None else r
+                         for r in batch if r.status is not None]
+
+                self.conn.executemany("UPDATE coords SET scanned=1 WHERE id=?", [(r.coord_id,) for r in batch])
+                hits = [r for r in batch if r.status == "OK"]
+                self.conn.executemany(
+                    "INSERT INTO results(coord_id,pano_id) VALUES(?,?)", [(r.coord_id, r.pano_id) for r in hits])
+                self.conn.executemany(
+                    "INSERT INTO panos(pano_id,lat,lon,date,coord_id) VALUES(?,?,?,?,?) "
+                    "ON CONFLICT(pano_id) DO UPDATE SET hits=hits+1",
+                    [(r.pano_id, *r.pano, r.coord_id) for r in hits])
+                # a point already queued (or scanned) by any earlier hit is ignored, never paid for twice
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO coords(lat,lon,ilat,ilon,stage) VALUES(?,?,?,?,?)",
+                    [(*from_lattice(ilat, ilon), ilat, ilon, stage) for r in batch for ilat, ilon, stage in r.new_points])
+                self.conn.executemany(
+                    "INSERT INTO responses(coord_id,response) VALUES(?,?)", [(r.coord_id, r.status) for r in batch])
+        except sqlite3.Error as e:
+            # the coordinates stay unscanned and are picked up again by the next scan
+            self.logger.log_exception(f"Failed to store {len(batch)} scan results: {e}")
+            return
+        self.written += len(batch)
+        self.commits += 1
+        if self.on_commit:
+            self.on_commit([r.coord_id for r in batch])
+
+
+if __name__ == "__main__":
+    # python Scan_Database.py [db files...]   (default: every database in Metadata_Maps)
+    logger = Logger(__name__)
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            conn = connect(path)
+            print(f"{path}: schema version {migrate_scan_db(conn)}")
+            conn.close()
+    else:
+        for path, version in migrate_folder(logger=logger).items():
+            print(f"{path}: schema version {version}")
@@ -0,0 +1,278 @@
+# Metadata scan engine with a constant number of requests in flight.
+# An asyncio loop hands coordinates to a thread pool as soon as a slot frees up (instead of
+# waiting for a whole batch), refills its work buffer from the coords table as it drains and
+# streams every result to the single ScanWriter the moment it arrives. Throughput is then bounded
+# by quota and latency only.
+# The strategy's seed grid is virtual: its points are enumerated from the scan bounds and a cursor
+# kept in scan_state, and only become coords rows once they are probed (or fail and need a retry),
+# so a country-sized scan starts immediately and the database only holds visited points.
+# With a region (Scan_Region) the seed grid covers its bounding box, and seed points and expansions
+# outside the shape are rejected in vectorised chunks before they are ever queued.
+
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from AppLogger import Logger
+from Quota_Manager import QuotaExceeded
+from Scan_Database import ScanResult, ScanWriter, connect, from_lattice, get_state, set_state, SEED_CURSOR
+from Scan_Strategies import GridStrategy, seed_point
+
+
+class ScanEngine:
+    def __init__(self, db_path, fetch, logger: Logger, concurrency: int = 10, strategy=None,
+                 writer_settings: dict = None, call_budget: int = 0, bounds: tuple = None, plan=None,
+                 region=None):
+        """
+        Args:
+            db_path (str): Scan database with the coords / results / responses tables
+            fetch (callable): fetch(lat, lon) -> metadata json dict, called on the engine's worker
+                threads (blocking HTTP with retries and quota waits is fine there)
+            logger (Logger): App logger
+            concurrency (int): Requests kept in flight
+            strategy: Scan strategy (Scan_Strategies) choosing the points queued after every result,
+                the coarse/fine GridStrategy by default
+            writer_settings (dict): ScanWriter keyword arguments (batch_size, flush_interval, synchronous)
+            call_budget (int): Most requests this run may send, 0 for no limit
+            bounds (tuple): (north, south, east, west) to cover with the strategy's seed grid;
+                None scans only what is already queued in the coords table
+            plan (ScanPlan): Scan_Planner.plan_scan result for the seed grid; its pruned seed
+                points are never probed
+            region: Scan_Region shape to stay inside; bounds default to its bounding box
+        """
+        self.db_path = db_path
+        self.fetch = fetch
+        self.logger = logger
+        self.concurrency = max(int(concurrency), 1)
+        self.strategy = strategy or GridStrategy()
+        self.call_budget = call_budget
+        self.writer_settings = writer_settings or {}
+        self.region = region
+        if bounds is None and region is not None:
+            bounds = region.bounds()
+        self.grid = self.strategy.seed_grid(*bounds) if bounds else None
+        self.plan = plan
+
+        self._stop = threading.Event()
+        self.requests = 0
+        self.found = 0
+        self.unique = 0
+        self.errors = 0
+        self.commits = 0
+        self.pruned = 0
+        self.outside = 0
+        self.elapsed = 0.0
+        self._uncommitted = 0
+        # next seed grid index to hand out, and the indices handed out but not yet stored
+        self.next_seed = 0
+        self._seeds_open = set()
+
+    def stop(self):
+        """
+        Stop claiming new coordinates; requests already in flight are finished and stored
+        """
+        self._stop.set()
+
+    def seeds_left(self) -> int:
+        """
+        Seed grid points not handed out yet
+        """
+        return self.grid.rows * self.grid.cols - self.next_seed if self.grid else 0
+
+    def calls_per_pano(self) -> float:
+        """
+        Metadata calls paid per new unique panorama this run, the cost the scan strategies compete on
+        """
+        if not self.unique:
+            return float("inf") if self.requests else 0.0
+        return self.requests / self.unique
+
+    def run(self) -> int:
+        """
+        Scan until no unscanned coordinate is left, the daily quota runs out or stop() is called.
+        Blocks the calling thread. Returns the number of coordinates scanned.
+        """
+        started = time.perf_counter()
+        asyncio.run(self._run())
+        self.elapsed = time.perf_counter() - started
+        rate = self.requests / self.elapsed if self.elapsed else 0.0
+        self.logger.log_status(
+            f"Scan engine finished: {self.requests} coordinates scanned, {self.found} with panoramas, "
+            f"{self.unique} new panoramas ({self.calls_per_pano():.2f} calls per new panorama), "
+            f"{self.errors} failed, {rate:.1f} requests/s with {self.concurrency} in flight, "
+            f"{self.commits} database commits, {self.pruned} seed points pruned, "
+            f"{self.outside} points outside the region skipped, {self.seeds_left()} seed points left")
+        return self.requests
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="scan")
+        self.conn = connect(self.db_path)
+        self._load_cursor()
+        # ids in flight or waiting for the writer's commit, or failed during this run (left
+        # unscanned for the next one); the coords table still shows all of them as unscanned
+        skip = set()
+        # lattice keys of seed points that failed this run, stored unscanned for the next one
+        self._failed_keys = set()
+        writer = ScanWriter(
+            self.db_path, self.logger,
+            on_commit=lambda ids: loop.call_soon_threadsafe(skip.difference_update, ids),
+            **self.writer_settings)
+        # panoramas found by earlier runs don't count as new
+        self.seen_panos = {row[0] for row in self.conn.execute("SELECT pano_id FROM panos")}
+        in_flight = {}    # future → ((id, lat, lon, stage), seed index or None)
+        buffer = deque()
+        dispatched = 0
+        try:
+            while True:
+                while len(in_flight) < self.concurrency and not self._stop.is_set():
+                    if self.call_budget and dispatched >= self.call_budget:
+                        self.logger.log_status(f"Call budget of {self.call_budget} requests reached, stopping scan")
+                        self._stop.set()
+                        break
+                    if not buffer:
+                        buffer.extend(self._claim(skip, self.concurrency * 2))
+                        if not buffer:
+                            break
+                    row, seed = buffer.popleft()
+                    if seed is None:
+                        skip.add(row[0])
+                    in_flight[loop.run_in_executor(executor, self.fetch, row[1], row[2])] = (row, seed)
+                    dispatched += 1
+
+                if not in_flight:
+                    if self._stop.is_set() or not self._uncommitted:
+                        break
+                    # fine points queued by uncommitted results only become claimable after a commit
+                    await loop.run_in_executor(None, writer.flush)
+                    self._uncommitted = 0
+                    continue
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    row, seed = in_flight.pop(future)
+                    try:
+                        data = future.result()
+                    except QuotaExceeded as e:
+                        # a seed point stays open, so the stored cursor never moves past it
+                        self.logger.log_status(f"Stopping scan: {e}", "WARNING")
+                        self._stop.set()
+                        continue
+                    except Exception as e:
+                        self.errors += 1
+                        self.logger.log_exception(f"Metadata request failed at ({row[1]},{row[2]}): {e}")
+                        if seed is not None:
+                            key = self._seed_key(seed)
+                            self._failed_keys.add(key)
+                            writer.put(ScanResult(None, None, None, [], (*key, row[3]), self._close_seed(seed), None))
+                        continue
+                    writer.put(self._result(row, data, seed))
+                    self._uncommitted += 1
+        finally:
+            executor.shutdown(wait=True)
+            writer.close()
+            self.commits = writer.commits
+            self.conn.close()
+
+    # --- seed grid ---
+
+    def _load_cursor(self):
+        """
+        Resume the seed grid where the last run stopped. A different grid (new bounds or
+        strategy settings) starts over; points already stored are skipped while claiming.
+        """
+        if self.grid is None:
+            return
+        signature = json.dumps(list(self.grid) if self.region is None else [list(self.grid), self.region.shape])
+        if get_state(self.conn, "seed_grid") == signature:
+            self.next_seed = int(get_state(self.conn, SEED_CURSOR) or 0)
+        else:
+            with self.conn:
+                set_state(self.conn, "seed_grid", signature)
+                set_state(self.conn, SEED_CURSOR, 0)
+            self.next_seed = 0
+
+    def _seed_key(self, seed: int) -> tuple[int, int]:
+        return seed_point(self.grid, seed)
+
+    def _close_seed(self, seed: int) -> int:
+        """
+        Mark a handed out seed point as stored. Returns the cursor that is safe to persist:
+        every index below it has been stored or skipped.
+        """
+        self._seeds_open.discard(seed)
+        return min(self._seeds_open) if self._seeds_open else self.next_seed
+
+    def _inside(self, ilat, ilon) -> np.ndarray:
+        lat, lon = from_lattice(np.asarray(ilat), np.asarray(ilon))
+        return self.region.contains(lat, lon)
+
+    def _claim_seeds(self, count: int) -> list[tuple]:
+        claimed = []
+        total = self.grid.rows * self.grid.cols
+        while len(claimed) < count and self.next_seed < total:
+            # the region test runs on a chunk of the grid at once
+            chunk = np.arange(self.next_seed, min(self.next_seed + max(count * 4, 1024), total))
+            keys = seed_point(self.grid, chunk)
+            inside = self._inside(*keys) if self.region is not None else np.ones(len(chunk), dtype=bool)
+            for seed, ilat, ilon, keep in zip(chunk.tolist(), keys[0].tolist(), keys[1].tolist(), inside.tolist()):
+                if len(claimed) == count:
+                    break
+                self.next_seed = seed + 1
+                if not keep:
+                    self.outside += 1
+                    continue
+                if self.plan and seed in self.plan.covered:
+                    self.pruned += 1
+                    continue
+                # already visited (earlier run, or a fine / refined point on the same key)
+                if self.conn.execute("SELECT 1 FROM coords WHERE ilat=? AND ilon=?", (ilat, ilon)).fetchone():
+                    continue
+                self._seeds_open.add(seed)
+                claimed.append(((None, *from_lattice(ilat, ilon), self.grid.stage), seed))
+        return claimed
+
+    def _claim(self, skip: set, count: int) -> list[tuple]:
+        """
+        Next coordinates as (row, seed index): queued rows first (fine points before coarse ones),
+        leaving out the ones in skip, then fresh points from the seed grid
+        """
+        cur = self.conn.execute(
+            "SELECT id, lat, lon, stage, ilat, ilon FROM coords WHERE scanned=0 ORDER BY stage DESC LIMIT ?",
+            (count + len(skip) + len(self._failed_keys),))
+        claimed = [
+            (row[:4], None) for row in cur.fetchall()
+            if row[0] not in skip and row[4:] not in self._failed_keys
+        ][:count]
+        if len(claimed) < count and self.grid is not None:
+            claimed += self._claim_seeds(count - len(claimed))
+        return claimed
+
+    def _result(self, row: tuple, data: dict, seed: int = None) -> ScanResult:
+        status = data.get("status")
+        pano_id = data.get("pano_id")
+        self.requests += 1
+        novel = False
+        pano = None
+        if status == "OK":
+            location = data.get("location") or {}
+            pano = (location.get("lat", row[1]), location.get("lng", row[2]), data.get("date"))
+            self.found += 1
+            novel = pano_id not in self.seen_panos
+            if novel:
+                self.seen_panos.add(pano_id)
+                self.unique += 1
+        new_points = self.strategy.expand(row, data, novel)
+        if new_points and self.region is not None:
+            ilat, ilon, _ = zip(*new_points)
+            inside = self._inside(ilat, ilon)
+            self.outside += len(new_points) - int(inside.sum())
+            new_points = [point for point, keep in zip(new_points, inside.tolist()) if keep]
+        if seed is None:
+            return ScanResult(row[0], status, pano_id, new_points, None, None, pano)
+        return ScanResult(None, status, pano_id, new_points, (*self._seed_key(seed), row[3]),
+                          self._close_seed(seed), pano)
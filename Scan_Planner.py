@@ -0,0 +1,139 @@
+# Scan planning: what a scan over a seed grid will cost before any request is sent.
+# Seed points whose search disc already holds a panorama from an earlier scan (panos table) would
+# most likely return that panorama again, so they are pruned; points already stored in coords are
+# skipped by the engine anyway. The rest, plus the unscanned coords queue, is the expected number
+# of metadata calls. Strategies that expand around hits (grid, quadtree) add calls on top of that.
+# Everything is computed on numpy arrays from the grid arithmetic, the grid itself is never listed.
+
+import math
+import sqlite3
+from collections import namedtuple
+
+import numpy as np
+
+from Scan_Database import LATTICE_SCALE, from_lattice
+from Scan_Strategies import METERS_PER_DEGREE, SeedGrid, seed_point
+
+# Seed points tested against a region per chunk
+REGION_CHUNK = 1_000_000
+# Above this many seed points the points inside a region are estimated from the shape's area
+# instead of counted; the engine tests every point it reaches anyway
+REGION_COUNT_LIMIT = 2_000_000
+
+# seeds:          points in the seed grid (inside the region, if there is one)
+# stored:         seed points with a coords row (probed by an earlier run, or queued by an expansion)
+# pruned:         seed points left out because a known panorama is inside their search disc
+# queued:         unscanned coords rows (failed seed points, queued expansions)
+# expected_calls: requests the scan sends before any expansion
+# covered:        seed grid indices that are pruned, for the engine to skip
+# estimated:      seeds (and so expected_calls) is estimated from the region's area
+ScanPlan = namedtuple("ScanPlan", ["seeds", "stored", "pruned", "queued", "expected_calls", "covered", "estimated"],
+                      defaults=[False])
+
+
+def _grid_indices(grid: SeedGrid, ilat: np.ndarray, ilon: np.ndarray) -> np.ndarray:
+    """
+    Seed grid index of every (ilat, ilon) that is exactly a seed point, -1 for the others
+    """
+    row, lat_off = np.divmod(grid.ilat0 - ilat, grid.lat_step)
+    col, lon_off = np.divmod(ilon - grid.ilon0 - (row % 2) * grid.shift, grid.lon_step)
+    on_grid = (lat_off == 0) & (lon_off == 0) & (row >= 0) & (row < grid.rows) & (col >= 0) & (col < grid.cols)
+    return np.where(on_grid, row * grid.cols + col, -1)
+
+
+def covered_seeds(grid: SeedGrid, lat: np.ndarray, lon: np.ndarray, radius: float) -> set[int]:
+    """
+    Indices of the seed points within radius metres of any of the given panorama positions.
+    Every panorama is checked against the few seed points around it, so the cost grows with
+    the number of panoramas, not with the size of the grid.
+    """
+    if len(lat) == 0 or grid.rows == 0 or grid.cols == 0:
+        return set()
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    radius_deg = radius / METERS_PER_DEGREE
+    scale = float(LATTICE_SCALE)
+    row_f = (grid.ilat0 / scale - lat) / (grid.lat_step / scale)
+    col_f = (lon - grid.ilon0 / scale) / (grid.lon_step / scale)
+    lat_reach = math.ceil(radius_deg * scale / grid.lat_step) + 1
+    # longitude degrees shrink towards the poles, so the same radius spans more columns there
+    widest = float(np.max(np.abs(lat)))
+    lon_reach = math.ceil(radius_deg * scale / (grid.lon_step * max(math.cos(math.radians(widest)), 1e-6))) + 1
+
+    covered = set()
+    base_row, base_col = np.floor(row_f).astype(np.int64), np.floor(col_f).astype(np.int64)
+    cos_lat = np.cos(np.radians(lat))
+    for d_row in range(-lat_reach, lat_reach + 1):
+        row = base_row + d_row
+        seed_lat = (grid.ilat0 - row * grid.lat_step) / scale
+        for d_col in range(-lon_reach, lon_reach + 1):
+            col = base_col + d_col
+            seed_lon = (grid.ilon0 + col * grid.lon_step + (row % 2) * grid.shift) / scale
+            # equirectangular distance, exact enough over a search radius
+            dist = np.hypot(seed_lat - lat, (seed_lon - lon) * cos_lat) * METERS_PER_DEGREE
+            hit = (dist <= radius) & (row >= 0) & (row < grid.rows) & (col >= 0) & (col < grid.cols)
+            covered.update((row[hit] * grid.cols + col[hit]).tolist())
+    return covered
+
+
+def _inside(grid: SeedGrid, region, indices) -> np.ndarray:
+    lat, lon = from_lattice(*seed_point(grid, np.asarray(indices, dtype=np.int64)))
+    return region.contains(lat, lon)
+
+
+def count_inside(grid: SeedGrid, region) -> tuple[int, bool]:
+    """
+    Seed points inside region, tested REGION_CHUNK points at a time, and whether the count is an
+    estimate: grids above REGION_COUNT_LIMIT points are scaled by the share of the bounding box
+    the shape covers instead
+    """
+    total = grid.rows * grid.cols
+    if total > REGION_COUNT_LIMIT:
+        return round(total * region.bounds_share()), True
+    return sum(int(_inside(grid, region, np.arange(start, min(start + REGION_CHUNK, total))).sum())
+               for start in range(0, total, REGION_CHUNK)), False
+
+
+def plan_scan(conn: sqlite3.Connection, grid: SeedGrid, radius: float = 0, region=None) -> ScanPlan:
+    """
+    Plan a scan of grid on the scan database behind conn.
+    radius: prune seed points with a known panorama within this many metres, 0 to keep them all
+    region: Scan_Region shape; seed points outside it are never probed and not counted
+    """
+    seeds, estimated = (grid.rows * grid.cols, False) if region is None else count_inside(grid, region)
+    ilat_min = grid.ilat0 - (grid.rows - 1) * grid.lat_step
+    ilon_max = grid.ilon0 + (grid.cols - 1) * grid.lon_step + grid.shift
+    rows = conn.execute(
+        "SELECT ilat, ilon FROM coords WHERE ilat BETWEEN ? AND ? AND ilon BETWEEN ? AND ?",
+        (ilat_min, grid.ilat0, grid.ilon0, ilon_max)).fetchall()
+    keys = np.array(rows, dtype=np.int64).reshape(-1, 2)
+    indices = _grid_indices(grid, keys[:, 0], keys[:, 1])
+    indices = indices[indices >= 0]
+    if region is not None and len(indices):
+        indices = indices[_inside(grid, region, indices)]
+    stored = set(indices.tolist())
+
+    covered = set()
+    if radius > 0:
+        # panoramas up to one radius outside the grid still cover its edge points
+        lat_margin = radius / METERS_PER_DEGREE
+        lat_lo, lat_hi = ilat_min / LATTICE_SCALE - lat_margin, grid.ilat0 / LATTICE_SCALE + lat_margin
+        lon_margin = lat_margin / max(math.cos(math.radians(max(abs(lat_lo), abs(lat_hi)))), 1e-6)
+        panos = np.array(conn.execute(
+            "SELECT lat, lon FROM panos WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?",
+            (lat_lo, lat_hi, grid.ilon0 / LATTICE_SCALE - lon_margin, ilon_max / LATTICE_SCALE + lon_margin)
+        ).fetchall(), dtype=np.float64).reshape(-1, 2)
+        covered = covered_seeds(grid, panos[:, 0], panos[:, 1], radius) - stored
+        if region is not None and covered:
+            candidates = np.fromiter(covered, dtype=np.int64, count=len(covered))
+            covered = set(candidates[_inside(grid, region, candidates)].tolist())
+
+    queued = conn.execute("SELECT COUNT(*) FROM coords WHERE scanned=0").fetchone()[0]
+    expected = max(seeds - len(stored) - len(covered), 0) + queued
+    return ScanPlan(seeds, len(stored), len(covered), queued, expected, covered, estimated)
+
+
+def describe_plan(plan: ScanPlan) -> str:
+    about = "about " if plan.estimated else ""
+    return (f"{about}{plan.expected_calls} metadata calls expected: {about}{plan.seeds} seed points, "
+            f"{plan.stored} already stored, {plan.pruned} pruned around known panoramas, "
+            f"{plan.queued} queued")
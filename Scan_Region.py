@@ -0,0 +1,119 @@
+# Scan and selection regions: rectangle, circle or polygon.
+# The scan engine and query_results work on a region's bounding box and reject the points outside
+# the shape with a vectorised test, so a non-rectangular district is never probed (or returned)
+# across its whole bounding box.
+# A region is built from a shape dict, the format the ApiWindow map sends when a shape is drawn:
+#   {"type": "rectangle", "coords": [[north, east], [south, west]]}
+#   {"type": "circle", "coords": [[lat, lng]], "radius": metres}
+#   {"type": "polygon", "coords": [[lat, lng], ...]}
+
+import math
+
+import numpy as np
+
+from Scan_Strategies import METERS_PER_DEGREE
+
+
+class BoxRegion:
+    def __init__(self, north, south, east, west):
+        self.north, self.south, self.east, self.west = north, south, east, west
+        self.shape = {"type": "rectangle", "coords": [[north, east], [south, west]]}
+
+    def bounds(self) -> tuple:
+        """
+        (north, south, east, west) bounding box
+        """
+        return self.north, self.south, self.east, self.west
+
+    def contains(self, lat, lon) -> np.ndarray:
+        lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+        return (lat <= self.north) & (lat >= self.south) & (lon <= self.east) & (lon >= self.west)
+
+    def bounds_share(self) -> float:
+        """
+        Share of the bounding box the shape covers, in degree space (where seed grids are uniform)
+        """
+        return 1.0
+
+
+class CircleRegion:
+    def __init__(self, lat, lon, radius):
+        """
+        Args:
+            lat, lon (float): Centre
+            radius (float): Radius in metres
+        """
+        self.lat, self.lon, self.radius = lat, lon, radius
+        self.shape = {"type": "circle", "coords": [[lat, lon]], "radius": radius}
+
+    def bounds(self) -> tuple:
+        dlat = self.radius / METERS_PER_DEGREE
+        dlon = dlat / max(math.cos(math.radians(self.lat)), 1e-6)
+        return self.lat + dlat, self.lat - dlat, self.lon + dlon, self.lon - dlon
+
+    def contains(self, lat, lon) -> np.ndarray:
+        lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+        # equirectangular distance, exact enough for a city-sized circle
+        dist = np.hypot(lat - self.lat, (lon - self.lon) * math.cos(math.radians(self.lat))) * METERS_PER_DEGREE
+        return dist <= self.radius
+
+    def bounds_share(self) -> float:
+        # an ellipse in degree space
+        return math.pi / 4
+
+
+class PolygonRegion:
+    def __init__(self, vertices):
+        """
+        Args:
+            vertices (list): [lat, lon] corners in drawing order; the polygon closes itself
+        """
+        if len(vertices) < 3:
+            raise ValueError(f"A polygon needs at least 3 vertices, got {len(vertices)}")
+        self.vertices = np.asarray(vertices, dtype=np.float64)
+        self.shape = {"type": "polygon", "coords": self.vertices.tolist()}
+
+    def bounds(self) -> tuple:
+        lat, lon = self.vertices[:, 0], self.vertices[:, 1]
+        return float(lat.max()), float(lat.min()), float(lon.max()), float(lon.min())
+
+    def contains(self, lat, lon) -> np.ndarray:
+        """
+        Even-odd ray casting: one pass per edge, each over all points at once
+        """
+        lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+        inside = np.zeros(np.broadcast(lat, lon).shape, dtype=bool)
+        lat1, lon1 = self.vertices[-1]
+        for lat2, lon2 in self.vertices:
+            # the edge crosses the point's parallel (horizontal edges never do)
+            crosses = (lat1 > lat) != (lat2 > lat)
+            if lat1 != lat2:
+                lon_at = lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1)
+                inside ^= crosses & (lon < lon_at)
+            lat1, lon1 = lat2, lon2
+        return inside
+
+    def bounds_share(self) -> float:
+        north, south, east, west = self.bounds()
+        if north == south or east == west:
+            return 0.0
+        lat, lon = self.vertices[:, 0], self.vertices[:, 1]
+        # shoelace formula
+        area = abs(np.dot(lat, np.roll(lon, -1)) - np.dot(lon, np.roll(lat, -1))) / 2
+        return min(float(area) / ((north - south) * (east - west)), 1.0)
+
+
+def region_from_shape(shape: dict):
+    """
+    Region for a shape dict (see the top of this module)
+    """
+    kind = str(shape.get("type", "")).lower()
+    coords = [[float(lat), float(lon)] for lat, lon in shape.get("coords", [])]
+    if kind == "rectangle" and len(coords) == 2:
+        (lat_a, lon_a), (lat_b, lon_b) = coords
+        return BoxRegion(max(lat_a, lat_b), min(lat_a, lat_b), max(lon_a, lon_b), min(lon_a, lon_b))
+    if kind == "circle" and len(coords) == 1 and float(shape.get("radius", 0)) > 0:
+        return CircleRegion(*coords[0], float(shape["radius"]))
+    if kind == "polygon":
+        return PolygonRegion(coords)
+    raise ValueError(f"Unsupported shape: {shape}")
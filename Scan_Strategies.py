@@ -0,0 +1,175 @@
+# Scan strategies decide which coordinates the metadata scan probes.
+# A strategy describes the seed grid covering an area and, for every result, returns the points
+# to queue next. ScanEngine stays the same whatever the strategy; all points are lattice keys
+# (see Scan_Database.to_lattice), so a point queued twice is still only probed once.
+#   grid      fixed coarse grid, eight fine neighbours around every coarse hit on a panorama that
+#             is not known yet (the original scan)
+#   quadtree  square cells probed at their centre and split into four while they keep finding
+#             new panoramas, down to a maximum depth
+#   hex       hexagonal covering by the metadata search radius: every spot of the area is inside
+#             one query's search disc, with the least overlap between neighbouring discs
+
+import math
+from collections import namedtuple
+
+from config_ import Config
+from Scan_Database import to_lattice, lattice_step
+
+# Metres per degree of latitude (and of longitude at the equator)
+METERS_PER_DEGREE = 111_320
+
+# A strategy's starting points: rows x cols lattice points from (ilat0, ilon0), lat_step / lon_step
+# apart, going south then east, with every odd row shifted east by shift (hexagonal grids).
+# Enumerated lazily by the scan engine, never stored as a whole.
+SeedGrid = namedtuple("SeedGrid", ["ilat0", "ilon0", "lat_step", "lon_step", "rows", "cols", "stage", "shift"])
+
+
+def seed_point(grid: SeedGrid, index: int) -> tuple[int, int]:
+    """
+    Lattice key of the index-th seed grid point (row-major, north-west corner first)
+    """
+    row, col = divmod(index, grid.cols)
+    return grid.ilat0 - row * grid.lat_step, grid.ilon0 + col * grid.lon_step + (row % 2) * grid.shift
+
+
+def _seed_grid(north, south, east, west, step: int, inset: int, stage: str) -> SeedGrid:
+    north_i, west_i = to_lattice(north, west)
+    south_i, east_i = to_lattice(south, east)
+    ilat0, ilon0 = north_i - inset, west_i + inset
+    rows = max((ilat0 - south_i + inset) // step + 1, 0)
+    cols = max((east_i + inset - ilon0) // step + 1, 0)
+    return SeedGrid(ilat0, ilon0, step, step, rows, cols, stage, 0)
+
+
+class GridStrategy:
+    def __init__(self, coarse_spacing: float = 0.003, fine_spacing: float = 0.001):
+        self.coarse_step = lattice_step(coarse_spacing)
+        self.fine_step = lattice_step(fine_spacing)
+
+    def seed_grid(self, north, south, east, west) -> SeedGrid:
+        """
+        The coarse grid; stepping in lattice integers keeps every point exact
+        """
+        return _seed_grid(north, south, east, west, self.coarse_step, 0, 'coarse')
+
+    def expand(self, row: tuple, data: dict, novel: bool) -> list[tuple[int, int, str]]:
+        _, lat, lon, stage = row
+        # a known panorama was already expanded around wherever it was first found
+        if data.get("status") != "OK" or stage != 'coarse' or not novel:
+            return []
+        ilat, ilon = to_lattice(lat, lon)
+        d = self.fine_step
+        return [(ilat + dlat, ilon + dlon, 'fine') for dlat in (-d, 0, d) for dlon in (-d, 0, d) if dlat or dlon]
+
+
+class QuadtreeStrategy:
+    def __init__(self, root_spacing: float = 0.008, max_depth: int = 4, min_depth: int = 1, novelty: float = 0.3):
+        """
+        Args:
+            root_spacing (float): Side of the top-level cells in degrees
+            max_depth (int): Deepest level a cell is split to (cell side root_spacing / 2**max_depth)
+            min_depth (int): Cells shallower than this are always split, hit or not, so sparse
+                roads between the root probes still get a chance
+            novelty (float): A probe that returns an already known panorama still splits its cell
+                while at least this share of the hits at its depth have been new panoramas
+        Stage of a cell at depth d is "qNN" so deeper (more promising) cells are claimed first.
+        """
+        self.max_depth = max_depth
+        self.min_depth = min_depth
+        self.novelty = novelty
+        # children sit a quarter side off their parent's centre; keep that exact down to max_depth
+        unit = 2 ** (max_depth + 1)
+        self.root_step = -(-lattice_step(root_spacing) // unit) * unit
+        # per depth: [hits, new panoramas]
+        self.stats = {}
+
+    @staticmethod
+    def stage(depth: int) -> str:
+        return f"q{depth:02d}"
+
+    def seed_grid(self, north, south, east, west) -> SeedGrid:
+        """
+        Centres of the root cells, the first one with its corner on the north-west bound
+        """
+        return _seed_grid(north, south, east, west, self.root_step, self.root_step // 2, self.stage(0))
+
+    def expand(self, row: tuple, data: dict, novel: bool) -> list[tuple[int, int, str]]:
+        _, lat, lon, stage = row
+        if not stage.startswith("q"):
+            return []
+        depth = int(stage[1:])
+        if depth >= self.max_depth:
+            return []
+
+        hit = data.get("status") == "OK"
+        if hit:
+            counts = self.stats.setdefault(depth, [0, 0])
+            counts[0] += 1
+            counts[1] += novel
+        if depth >= self.min_depth:
+            if not hit:
+                return []
+            hits, new = self.stats[depth]
+            if not novel and new / hits < self.novelty:
+                return []
+
+        ilat, ilon = to_lattice(lat, lon)
+        q = self.root_step >> (depth + 2)
+        return [(ilat + dlat, ilon + dlon, self.stage(depth + 1)) for dlat in (-q, q) for dlon in (-q, q)]
+
+
+class HexStrategy:
+    def __init__(self, radius: float = 50):
+        """
+        Args:
+            radius (float): Metadata search radius in metres; every query finds the nearest
+                panorama within this distance
+        Centres sit on a triangular lattice sqrt(3) * radius apart, rows 1.5 * radius apart, which
+        is the sparsest set of discs that leaves no gap. There is no expansion: the seed grid
+        already covers the area.
+        """
+        self.radius = radius
+
+    def seed_grid(self, north, south, east, west) -> SeedGrid:
+        # a degree of longitude is longest at the latitude closest to the equator; spacing the
+        # columns for that latitude keeps the covering gap-free across the whole area
+        widest = 0.0 if south <= 0 <= north else min(abs(north), abs(south))
+        lat_step = lattice_step(1.5 * self.radius / METERS_PER_DEGREE)
+        lon_step = lattice_step(math.sqrt(3) * self.radius / (METERS_PER_DEGREE * math.cos(math.radians(widest))))
+        lon_step -= lon_step % 2
+        north_i, west_i = to_lattice(north, west)
+        south_i, east_i = to_lattice(south, east)
+        # one extra column so the shifted rows still reach the east edge
+        rows = max((north_i - south_i) // lat_step + 2, 0)
+        cols = max((east_i - west_i) // lon_step + 2, 0)
+        return SeedGrid(north_i, west_i, lat_step, lon_step, rows, cols, "hex", lon_step // 2)
+
+    def expand(self, row: tuple, data: dict, novel: bool) -> list[tuple[int, int, str]]:
+        return []
+
+
+def get_metadata_radius(config: Config) -> float:
+    """
+    [Scanner] metadata_radius: search radius in metres sent with every metadata request
+    """
+    return float(config.get("Scanner", "metadata_radius", fallback="50"))
+
+
+def get_scan_strategy(config: Config):
+    """
+    Strategy named by [Scanner] strategy, configured from [Scanner] and the [Download] grid spacings
+    """
+    name = config.get("Scanner", "strategy", fallback="grid").strip().lower()
+    if name == "hex":
+        return HexStrategy(get_metadata_radius(config))
+    if name == "quadtree":
+        return QuadtreeStrategy(
+            root_spacing=float(config.get("Scanner", "quadtree_root_spacing", fallback="0.008")),
+            max_depth=int(config.get("Scanner", "quadtree_max_depth", fallback="4")),
+            min_depth=int(config.get("Scanner", "quadtree_min_depth", fallback="1")),
+            novelty=float(config.get("Scanner", "quadtree_novelty", fallback="0.3")),
+        )
+    if name != "grid":
+        raise ValueError(f"Unknown scan strategy {name}, expected grid, quadtree or hex")
+    download = config.get_download_data()
+    return GridStrategy(float(download["coarse_spacing"]), float(download["fine_spacing"]))
@@ -5,11 +5,16 @@
 
 import os
 import math
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 import numpy as np
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from collections import namedtuple
 from PIL import Image
-from utils import resolve_path
+from utils import resolve_path, pyramid_level_path
 
 from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception
 from dotenv import load_dotenv
@@ -21,18 +26,109 @@ logger = Logger(__name__)
 from config_ import Config
 config = Config(logger)
 
+from Face_Cache import get_face_cache
+from Quota_Manager import get_quota_manager, retry_if_rate_limited
+
 region = config.get_general_data()['region']
 
 
-def fetch_cube_faces(pano_id: str, logger=None):
+# (name, heading, pitch) of every cube face requested from the Static API
+FACE_VIEWS = [
+    ("front", 0, 0), ("right", 90, 0), ("back", 180, 0), ("left", 270, 0),
+    ("up", 0, 90), ("down", 0, -90),
+]
+
+_session = None
+_face_executor = None
+_reproject_executor = None
+_http_lock = threading.Lock()
+_reproject_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Shared keep-alive session. Its connection pool is sized from [Download] http_pool_size
+    so concurrent face requests reuse TCP+TLS connections instead of opening new ones.
+    """
+    global _session
+    if _session is None:
+        with _http_lock:
+            if _session is None:
+                pool_size = int(config.get("Download", "http_pool_size", fallback="32"))
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get_face_executor() -> ThreadPoolExecutor:
+    """
+    Thread pool shared by every fetch_cube_faces call in the process
+    """
+    global _face_executor
+    if _face_executor is None:
+        with _http_lock:
+            if _face_executor is None:
+                workers = int(config.get("Download", "face_fetch_workers", fallback="12"))
+                _face_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="face-fetch")
+    return _face_executor
+
+
+def _fetch_face(base_url, params, logger, session, cache, pano_id, heading, pitch, FACE_SIZE) -> bytes:
+    """
+    Raw bytes of one face: from the face cache when present, otherwise from the API (then cached)
+    """
+    if cache is not None:
+        data = cache.get(pano_id, heading, pitch, FACE_SIZE)
+        if data is not None:
+            return data
+    data = safe_get(base_url, params=params, logger=logger, session=session).content
+    if cache is not None:
+        cache.put(pano_id, heading, pitch, FACE_SIZE, data)
+    return data
+
+
+def face_views(names=None) -> list[tuple[str, int, int]]:
+    """
+    (name, heading, pitch) of the faces in names, all six if names is None
+    """
+    return [view for view in FACE_VIEWS if names is None or view[0] in names]
+
+def faces_cached(pano_id: str, FACE_SIZE: int = None, names=None) -> bool:
+    """
+    True if the face cache holds every face in names, i.e. fetch_cube_faces(cache_only=True) will succeed
+    """
+    cache = get_face_cache(config, config.logger)
+    FACE_SIZE = int(FACE_SIZE or config.get_download_data()['face_size'])
+    return cache is not None and cache.has_pano(pano_id, FACE_SIZE, face_views(names))
+
+def fetch_cube_faces(pano_id: str, logger=None, FACE_SIZE: int = None, cache_only: bool = False, names=None):
     """
     Fetch the six cube faces from the Static API:
       headings 0,90,180,270 at pitch=0 → front, right, back, left
       plus pitch=+90 (up) and pitch=-90 (down)
+    Faces are read from the face cache first; misses are requested concurrently over the
+    shared session. With cache_only=True a miss raises KeyError instead of calling the API.
+    names restricts the fetch to those faces (e.g. EQUATORIAL_FACES).
     Returns dict of PIL Images.
     """
-    BASE_URL = "https://maps.googleapis.com/maps/api/streetview"
-    FACE_SIZE = int(config.get_download_data()['face_size'])
+    views = face_views(names)
+    BASE_URL = config.get_streetview_base_url()
+    FACE_SIZE = int(FACE_SIZE or config.get_download_data()['face_size'])
+    cache = get_face_cache(config, config.logger)
+    if cache_only:
+        if cache is None:
+            raise KeyError("Face cache is disabled, cannot render without the API")
+        faces = {}
+        for name, heading, pitch in views:
+            data = cache.get(pano_id, heading, pitch, FACE_SIZE)
+            if data is None:
+                raise KeyError(f"Face {name} of {pano_id} at size {FACE_SIZE} is not cached")
+            faces[name] = Image.open(BytesIO(data))
+        return faces
+
     key = os.getenv("API_KEY")
     params = {
         "size": f"{FACE_SIZE}x{FACE_SIZE}",
@@ -40,19 +136,18 @@ def fetch_cube_faces(pano_id: str, logger=None):
         "fov": 90,
         "key": key
     }
-    faces = {}
+    session = get_session()
+    executor = get_face_executor()
 
-    # equator faces
-    for heading, name in [(0, "front"), (90, "right"), (180, "back"), (270, "left")]:
-        params.update({"heading": heading, "pitch": 0})
-        resp = safe_get(BASE_URL, params=params, logger=logger)
-        faces[name] = Image.open(BytesIO(resp.content))
-
-    # up/down
-    for pitch, name in [(90, "up"), (-90, "down")]:
-        params.update({"heading": 0, "pitch": pitch})
-        resp = safe_get(BASE_URL, params=params, logger=logger)
-        faces[name] = Image.open(BytesIO(resp.content))
+    futures = {
+        name: executor.submit(
+            _fetch_face, BASE_URL, {**params, "heading": heading, "pitch": pitch},
+            logger, session, cache, pano_id, heading, pitch, FACE_SIZE)
+        for name, heading, pitch in views
+    }
+    faces = {}
+    for name, future in futures.items():
+        faces[name] = Image.open(BytesIO(future.result()))
 
     return faces
 
@@ -67,15 +162,24 @@ def retry_if_5xx_error(exception):
 @retry(
     wait=wait_exponential(multiplier=1, min=2, max=10),
     stop=stop_after_attempt(3),
-    retry=retry_if_exception(retry_if_5xx_error)
+    retry=retry_if_exception(retry_if_5xx_error) | retry_if_exception(retry_if_rate_limited)
 )
-def safe_get(url, params, logger=None):
+def safe_get(url, params, logger=None, session: requests.Session = None, endpoint: str = "streetview"):
+    quota = get_quota_manager(config, config.logger)
+    # paced by the shared quota service; raises QuotaExceeded (not retried) once today's budget is spent
+    quota.acquire(endpoint)
     try:
-        resp = requests.get(url, params=params, timeout=10)
+        resp = (session or get_session()).get(url, params=params, timeout=10)
+        quota.on_response(endpoint, resp)
         if 200 <= resp.status_code < 300:
             if logger:
                 logger.log_status(f"✅ Success {resp.status_code} for {resp.url}")
             return resp
+        elif resp.status_code == 429:
+            # Retried once the quota service's Retry-After pause has passed
+            if logger:
+                logger.log_status(f"⚠️ Rate limited {resp.status_code} for {resp.url}, retrying...")
+            resp.raise_for_status()
         elif 400 <= resp.status_code < 500:
             # Don’t retry
             if logger:
@@ -102,88 +206,566 @@ def orient_faces(faces: dict[str,Image.Image]) -> dict[str,Image.Image]:
     faces["right"] = faces["right"].rotate(180, expand=False)
     return faces
 
-def cube_to_equirectangular(faces: dict, FACE_SIZE = int(config.get_download_data()['face_size'])):
+FACE_ORDER = ("front", "right", "back", "left", "up", "down")
+EQUATORIAL_FACES = ("front", "right", "back", "left")
+# The four equatorial faces alone cover every direction up to this latitude (reached at the
+# face corners; straight ahead they reach 45°). Beyond it a band needs the up/down faces.
+EQUATORIAL_COVERAGE_DEG = math.degrees(math.atan(1 / math.sqrt(2)))
+# Faces that orient_faces() rotates by 180 degrees before sampling
+ROTATED_FACES = ("front", "back", "left", "right")
+REMAP_VERSION = 2
+INTERPOLATION_MODES = ("nearest", "bilinear")
+
+RemapTable = namedtuple("RemapTable", ["face", "u", "v", "index", "base", "wu", "wv"])
+_remap_tables: dict[int, RemapTable] = {}
+_remap_lock = threading.Lock()
+
+
+def get_remap_cache_dir() -> Path:
     """
-    Reproject 6 cube faces (dict with keys front, right, back, left, up, down)
-    into one equirectangular image of size (4*FACE_SIZE, 2*FACE_SIZE).
+    Folder where the persisted remap tables (.npy) are kept
+    """
+    folder = config.get("Download", "remap_cache_folder", fallback="cache\\remap")
+    return Path(resolve_path(folder))
+
+
+# Rough working-set bytes per output pixel, used to size row bands under the memory ceiling
+BUILD_BYTES_PER_PIXEL = 96
+REPROJECT_BYTES_PER_PIXEL = {"nearest": 8, "bilinear": 64}
+REMAP_DTYPES = {"face": np.uint8, "u": np.float32, "v": np.float32, "index": np.int32,
+                "base": np.int32, "wu": np.uint16, "wv": np.uint16}
+
+
+def get_band_rows(width: int, bytes_per_pixel: int, memory_mb: float = None) -> int:
+    """
+    Number of output rows processed per band so the temporaries stay under
+    [Download] reproject_memory_mb (input faces and the output image not included)
+    """
+    if memory_mb is None:
+        memory_mb = float(config.get("Download", "reproject_memory_mb", fallback="32"))
+    return max(1, int(memory_mb * 1024 * 1024 // (width * bytes_per_pixel)))
+
+
+def _remap_rows(FACE_SIZE: int, row0: int, row1: int) -> RemapTable:
+    """
+    Remap table entries for output rows [row0, row1)
     """
     W = 4 * FACE_SIZE
     H = 2 * FACE_SIZE
     # Prepare output pixel grid
-    ys, xs = np.indices((H, W), dtype=np.float32)
+    ys, xs = np.indices((row1 - row0, W), dtype=np.float32)
+    ys += row0
     lon = (xs / W) * 2 * math.pi - math.pi
     lat = math.pi/2 - (ys / H) * math.pi
+    del xs, ys
 
     # Convert spherical to Cartesian
     x = np.cos(lat) * np.cos(lon)
     y = np.cos(lat) * np.sin(lon)
     z = np.sin(lat)
+    del lat, lon
 
-    # Which face?
     abs_x, abs_y, abs_z = np.abs(x), np.abs(y), np.abs(z)
-    # Initialize empty arrays
-    out = np.zeros((H, W, 3), dtype=np.uint8)
 
-    def sample(face_img, uc, vc):
+    shape = x.shape
+    face = np.zeros(shape, dtype=np.uint8)
+    u = np.zeros(shape, dtype=np.float32)
+    v = np.zeros(shape, dtype=np.float32)
+    index = np.zeros(shape, dtype=np.int32)
+
+    # (face name, mask, uc, vc) in the same order/priority as the original per-face sampling
+    selections = [
+        ("front", (abs_x >= abs_y) & (abs_x >= abs_z) & (x > 0), lambda m: (-y[m] / abs_x[m], z[m] / abs_x[m])),
+        ("back",  (abs_x >= abs_y) & (abs_x >= abs_z) & (x < 0), lambda m: ( y[m] / abs_x[m], z[m] / abs_x[m])),
+        ("right", (abs_y > abs_x) & (abs_y >= abs_z) & (y > 0),  lambda m: ( x[m] / abs_y[m], z[m] / abs_y[m])),
+        ("left",  (abs_y > abs_x) & (abs_y >= abs_z) & (y < 0),  lambda m: (-x[m] / abs_y[m], z[m] / abs_y[m])),
+        ("up",    (abs_z > abs_x) & (abs_z > abs_y) & (z > 0),   lambda m: ( y[m] / abs_z[m], x[m] / abs_z[m])),
+        ("down",  (abs_z > abs_x) & (abs_z > abs_y) & (z < 0),   lambda m: ( y[m] / abs_z[m], -x[m] / abs_z[m])),
+    ]
+
+    for name, mask, coords in selections:
+        k = FACE_ORDER.index(name)
+        uc, vc = coords(mask)
         # uc, vc are floats in [-1,1] for face coords → map to [0, FACE_SIZE)
-        u = ((uc + 1) / 2) * (FACE_SIZE - 1)
-        v = ((vc + 1) / 2) * (FACE_SIZE - 1)
-        u = np.clip(np.round(u).astype(int), 0, FACE_SIZE-1)
-        v = np.clip(np.round(v).astype(int), 0, FACE_SIZE-1)
-        arr = np.array(face_img)
-        return arr[v, u]
-
-    faces = orient_faces(faces=faces)
-
-    # Front face: +X major
-    mask = (abs_x >= abs_y) & (abs_x >= abs_z) & (x > 0)
-    uc = -y[mask] / abs_x[mask]
-    vc =  z[mask] / abs_x[mask]
-    out[mask] = sample(faces["front"], uc, vc)
-
-    # Back face: -X major
-    mask = (abs_x >= abs_y) & (abs_x >= abs_z) & (x < 0)
-    uc =  y[mask] / abs_x[mask]
-    vc =  z[mask] / abs_x[mask]
-    out[mask] = sample(faces["back"], uc, vc)
-
-    # Right face: +Y major
-    mask = (abs_y > abs_x) & (abs_y >= abs_z) & (y > 0)
-    uc =  x[mask] / abs_y[mask]
-    vc =  z[mask] / abs_y[mask]
-    out[mask] = sample(faces["right"], uc, vc)
-
-    # Left face: -Y major
-    mask = (abs_y > abs_x) & (abs_y >= abs_z) & (y < 0)
-    uc = -x[mask] / abs_y[mask]
-    vc =  z[mask] / abs_y[mask]
-    out[mask] = sample(faces["left"], uc, vc)
-
-    # Up face: +Z major
-    mask = (abs_z > abs_x) & (abs_z > abs_y) & (z > 0)
-    uc =  y[mask] / abs_z[mask]
-    vc =  x[mask] / abs_z[mask]
-    out[mask] = sample(faces["up"], uc, vc)
-
-    # Down face: -Z major
-    mask = (abs_z > abs_x) & (abs_z > abs_y) & (z < 0)
-    uc =  y[mask] / abs_z[mask]
-    vc = -x[mask] / abs_z[mask]
-    out[mask] = sample(faces["down"], uc, vc)
-
-    return Image.fromarray(out)
-
-def download_panorama(pano_id: str, save_dir: str, coords: tuple[float,float], face):
+        fu = ((uc + 1) / 2) * (FACE_SIZE - 1)
+        fv = ((vc + 1) / 2) * (FACE_SIZE - 1)
+        iu = np.clip(np.round(fu).astype(np.int64), 0, FACE_SIZE-1)
+        iv = np.clip(np.round(fv).astype(np.int64), 0, FACE_SIZE-1)
+        if name in ROTATED_FACES:
+            fu, fv = (FACE_SIZE - 1) - fu, (FACE_SIZE - 1) - fv
+            iu, iv = (FACE_SIZE - 1) - iu, (FACE_SIZE - 1) - iv
+        face[mask] = k
+        u[mask] = fu
+        v[mask] = fv
+        index[mask] = (k * FACE_SIZE + iv) * FACE_SIZE + iu
+
+    # Bilinear taps: top-left corner kept one pixel inside the face so +1 / +FACE_SIZE stay on it
+    u0 = np.clip(np.floor(u), 0, FACE_SIZE - 2).astype(np.int32)
+    v0 = np.clip(np.floor(v), 0, FACE_SIZE - 2).astype(np.int32)
+    wu = np.clip(np.round((u - u0) * 256), 0, 256).astype(np.uint16)
+    wv = np.clip(np.round((v - v0) * 256), 0, 256).astype(np.uint16)
+    base = (face.astype(np.int32) * FACE_SIZE + v0) * FACE_SIZE + u0
+
+    return RemapTable(face, u, v, index, base, wu, wv)
+
+
+def build_remap_table(FACE_SIZE: int, out: RemapTable = None, band_rows: int = None) -> RemapTable:
+    """
+    Compute, for every pixel of the (2*FACE_SIZE, 4*FACE_SIZE) equirectangular output,
+    which cube face it samples (index into FACE_ORDER) and where on that face.
+    u, v are fractional pixel coordinates on the raw (un-rotated) face, index is the
+    nearest-neighbour flat index into a stacked (6, FACE_SIZE, FACE_SIZE) face buffer.
+    base is the flat index of the top-left bilinear neighbour and wu, wv its weights
+    in 1/256 steps. The 180 degree rotation done by orient_faces() is baked into the table.
+
+    The table is filled in row bands so the trigonometry temporaries stay under the memory
+    ceiling; pass out (e.g. np.lib.format.open_memmap arrays) to write it straight to disk.
+    """
+    W = 4 * FACE_SIZE
+    H = 2 * FACE_SIZE
+    if out is None:
+        out = RemapTable(*(np.empty((H, W), dtype=REMAP_DTYPES[f]) for f in RemapTable._fields))
+    band_rows = band_rows or get_band_rows(W, BUILD_BYTES_PER_PIXEL)
+    for row0 in range(0, H, band_rows):
+        row1 = min(row0 + band_rows, H)
+        part = _remap_rows(FACE_SIZE, row0, row1)
+        for field in RemapTable._fields:
+            getattr(out, field)[row0:row1] = getattr(part, field)
+    return out
+
+
+def _remap_files(FACE_SIZE: int) -> dict[str, Path]:
+    folder = get_remap_cache_dir()
+    return {
+        field: folder / f"remap_v{REMAP_VERSION}_{FACE_SIZE}_{field}.npy"
+        for field in RemapTable._fields
+    }
+
+
+def _load_remap_files(files: dict[str, Path]) -> RemapTable:
+    return RemapTable(*(np.load(files[f], mmap_mode="r") for f in RemapTable._fields))
+
+
+def get_remap_table(FACE_SIZE: int) -> RemapTable:
+    """
+    Return the remap table for FACE_SIZE. Tables are built once, persisted to the
+    remap cache folder and memory-mapped (read-only) on every later use, so processes
+    reprojecting in parallel share the same pages.
+    """
+    FACE_SIZE = int(FACE_SIZE)
+    table = _remap_tables.get(FACE_SIZE)
+    if table is not None:
+        return table
+
+    with _remap_lock:
+        table = _remap_tables.get(FACE_SIZE)
+        if table is not None:
+            return table
+
+        files = _remap_files(FACE_SIZE)
+        try:
+            table = _load_remap_files(files)
+        except (OSError, ValueError):
+            logger.log_status(f"Building remap table for face size {FACE_SIZE}")
+            shape = (2 * FACE_SIZE, 4 * FACE_SIZE)
+            try:
+                os.makedirs(get_remap_cache_dir(), exist_ok=True)
+                # build straight into temp files so neither memory nor a concurrent reader sees a full/partial table
+                tmp = {field: path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy") for field, path in files.items()}
+                out = RemapTable(*(np.lib.format.open_memmap(tmp[f], mode="w+", dtype=REMAP_DTYPES[f], shape=shape)
+                                   for f in RemapTable._fields))
+                build_remap_table(FACE_SIZE, out=out)
+                for field, path in files.items():
+                    getattr(out, field).flush()
+                del out
+                for field, path in files.items():
+                    os.replace(tmp[field], path)
+                table = _load_remap_files(files)
+                logger.log_status(f"Remap table for face size {FACE_SIZE} saved to {get_remap_cache_dir()}")
+            except OSError as e:
+                logger.log_exception(f"Could not persist remap table, keeping it in memory: {e}")
+                table = build_remap_table(FACE_SIZE)
+
+        _remap_tables[FACE_SIZE] = table
+        return table
+
+
+def stack_faces(faces: dict, FACE_SIZE: int, out: np.ndarray = None) -> np.ndarray:
+    """
+    Copy the six faces into one contiguous (6, FACE_SIZE, FACE_SIZE, 3) uint8 buffer in
+    FACE_ORDER. Faces may be PIL Images or arrays; pass out to reuse a buffer between panoramas.
+    Faces missing from the dict (partial-sphere downloads) are left black.
+    """
+    if out is None:
+        out = np.empty((6, FACE_SIZE, FACE_SIZE, 3), dtype=np.uint8)
+    for k, name in enumerate(FACE_ORDER):
+        img = faces.get(name)
+        if img is None:
+            out[k] = 0
+            continue
+        if isinstance(img, Image.Image):
+            img = img.convert("RGB")
+        out[k] = np.asarray(img)
+    return out
+
+
+def get_reproject_threads() -> int:
+    """
+    [Download] reproject_threads, where 0 means one thread per CPU core
+    """
+    threads = int(config.get("Download", "reproject_threads", fallback="0"))
+    return threads if threads > 0 else (os.cpu_count() or 1)
+
+
+def get_reproject_executor() -> ThreadPoolExecutor:
+    """
+    Thread pool shared by every multi-threaded reprojection in the process
+    """
+    global _reproject_executor
+    if _reproject_executor is None:
+        with _reproject_lock:
+            if _reproject_executor is None:
+                _reproject_executor = ThreadPoolExecutor(max_workers=get_reproject_threads(), thread_name_prefix="reproject")
+    return _reproject_executor
+
+
+def _reproject_band(flat: np.ndarray, table: RemapTable, mode: str, FACE_SIZE: int, window, out: np.ndarray):
+    """
+    Gather one window of the output into out (a C-contiguous slice of the result).
+    Only np.take and ufuncs with uint8/16/32 data run here, and numpy releases the GIL
+    for those, so bands on different threads run truly in parallel.
+    """
+    if mode == "nearest":
+        # indices are always in range, mode="clip" lets take write into out without buffering
+        np.take(flat, table.index[window], axis=0, out=out, mode="clip")
+        return
+
+    # Fixed-point bilinear: four gathers off one base index, blended in integer math
+    base = np.asarray(table.base[window])
+    wu = np.asarray(table.wu[window])[..., None]
+    wv = np.asarray(table.wv[window])[..., None]
+    top = np.take(flat, base, axis=0).astype(np.uint16) * (256 - wu)
+    top += np.take(flat, base + 1, axis=0) * wu
+    bottom = np.take(flat, base + FACE_SIZE, axis=0).astype(np.uint16) * (256 - wu)
+    bottom += np.take(flat, base + FACE_SIZE + 1, axis=0) * wu
+    acc = top.astype(np.uint32) * (256 - wv)
+    acc += bottom.astype(np.uint32) * wv
+    acc += 1 << 15
+    acc >>= 16
+    out[...] = acc
+
+
+def reproject(stack: np.ndarray, mode: str = "nearest", table: RemapTable = None, region: tuple[int, int, int, int] = None,
+              out: np.ndarray = None, band_rows: int = None, threads: int = 1) -> np.ndarray:
+    """
+    Fill the equirectangular output from a stacked face buffer with indexed gathers.
+    The output is processed in row bands sized from [Download] reproject_memory_mb, so the
+    working set stays bounded even at face_size 2048.
+
+    Args:
+        stack (np.ndarray): (6, F, F, 3) uint8 buffer from stack_faces
+        mode (str): "nearest" or "bilinear"
+        table (RemapTable): remap table for F, looked up from the cache when omitted
+        region (tuple): optional (row0, row1, col0, col1) window of the output to render instead of all of it
+        out (np.ndarray): optional C-contiguous uint8 buffer of the output shape to render into
+        band_rows (int): rows per band, overrides the memory ceiling
+        threads (int): bands are spread over this many threads of the shared reprojection
+            pool (0 = [Download] reproject_threads); the memory ceiling then applies per thread
+
+    Returns:
+        np.ndarray: (2F, 4F, 3) uint8 image, or the requested window of it
+    """
+    if mode not in INTERPOLATION_MODES:
+        raise ValueError(f"Unknown interpolation mode {mode}. Expected one of {INTERPOLATION_MODES}")
+    FACE_SIZE = stack.shape[1]
+    table = table if table is not None else get_remap_table(FACE_SIZE)
+    flat = stack.reshape(-1, 3)
+    row0, row1, col0, col1 = region if region is not None else (0, 2 * FACE_SIZE, 0, 4 * FACE_SIZE)
+    if out is None:
+        out = np.empty((row1 - row0, col1 - col0, 3), dtype=np.uint8)
+
+    band_rows = band_rows or get_band_rows(col1 - col0, REPROJECT_BYTES_PER_PIXEL[mode])
+    threads = threads if threads > 0 else get_reproject_threads()
+    if threads > 1:
+        # a few bands per thread keeps the threads evenly loaded
+        band_rows = max(1, min(band_rows, -(-(row1 - row0) // (threads * 4))))
+
+    bands = [(band0, min(band0 + band_rows, row1)) for band0 in range(row0, row1, band_rows)]
+    if threads <= 1 or len(bands) == 1:
+        for band0, band1 in bands:
+            _reproject_band(flat, table, mode, FACE_SIZE, np.s_[band0:band1, col0:col1], out[band0 - row0:band1 - row0])
+        return out
+
+    executor = get_reproject_executor()
+    futures = [
+        executor.submit(_reproject_band, flat, table, mode, FACE_SIZE, np.s_[band0:band1, col0:col1], out[band0 - row0:band1 - row0])
+        for band0, band1 in bands
+    ]
+    for future in futures:
+        future.result()
+    return out
+
+
+def cube_to_equirectangular(faces: dict, FACE_SIZE = int(config.get_download_data()['face_size']), mode: str = "nearest",
+                            threads: int = 0, latitude_band=None):
+    """
+    Reproject 6 cube faces (dict with keys front, right, back, left, up, down)
+    into one equirectangular image of size (4*FACE_SIZE, 2*FACE_SIZE).
+    Uses the cached remap table, so this is a single gather with no trigonometry.
+    Runs on [Download] reproject_threads threads by default (threads=0).
+    With latitude_band set only the rows within ±latitude_band degrees of the horizon are rendered.
+    """
+    FACE_SIZE = int(FACE_SIZE)
+    stack = stack_faces(faces, FACE_SIZE)
+    return Image.fromarray(render_window(stack, mode=mode, latitude_band=latitude_band, threads=threads))
+
+def get_latitude_band():
+    """
+    Degrees above and below the horizon to render when [Download] partial_sphere is on,
+    None when the whole sphere is downloaded
+    """
+    if not config.get_bool("Download", "partial_sphere", fallback=False):
+        return None
+    degrees = float(config.get("Download", "latitude_band", fallback="35"))
+    if degrees > EQUATORIAL_COVERAGE_DEG:
+        logger.log_status(
+            f"latitude_band {degrees}° exceeds the {EQUATORIAL_COVERAGE_DEG:.1f}° the equatorial faces cover, "
+            f"the corners of the band will be black")
+    return min(max(degrees, 0.0), 90.0)
+
+def get_fetch_faces(latitude_band=None) -> tuple:
+    """
+    Faces to download: only the equatorial ones in partial-sphere mode
+    """
+    return EQUATORIAL_FACES if latitude_band is not None else FACE_ORDER
+
+def latitude_rows(FACE_SIZE: int, degrees: float) -> tuple[int, int]:
+    """
+    Output rows [row0, row1) of the equirectangular image that lie within ±degrees of the horizon
+    """
+    H = 2 * FACE_SIZE
+    row0 = int(math.floor((90 - degrees) / 180 * H))
+    row1 = int(math.ceil((90 + degrees) / 180 * H))
+    return max(row0, 0), min(row1, H)
+
+def render_window(stack: np.ndarray, mode: str = "nearest", region: tuple[int, int, int, int] = None,
+                  latitude_band=None, threads: int = 1, out: np.ndarray = None) -> np.ndarray:
+    """
+    Render region (row0, row1, col0, col1) of the equirectangular image, computing only the rows
+    within ±latitude_band degrees of the horizon and leaving the rest black. latitude_band=None renders everything.
+    out: optional uint8 buffer of the region's shape to render into
+    """
+    FACE_SIZE = stack.shape[1]
+    row0, row1, col0, col1 = region or (0, 2 * FACE_SIZE, 0, 4 * FACE_SIZE)
+    if latitude_band is None:
+        return reproject(stack, mode=mode, region=(row0, row1, col0, col1), out=out, threads=threads)
+
+    if out is None:
+        out = np.zeros((row1 - row0, col1 - col0, 3), dtype=np.uint8)
+    else:
+        out[...] = 0
+    band0, band1 = latitude_rows(FACE_SIZE, latitude_band)
+    band0, band1 = max(band0, row0), min(band1, row1)
+    if band0 < band1 and col0 < col1:
+        reproject(stack, mode=mode, region=(band0, band1, col0, col1),
+                  out=out[band0 - row0:band1 - row0], threads=threads)
+    return out
+
+def get_crop_geometry() -> tuple[int, int]:
+    """
+    (x, y) extent that CropStreetWindow cuts from each panorama: size_of_images width and
+    height minus blur_region_height, split into two halves of x // 2
+    """
+    size_img = config.get_image_size()
+    if isinstance(size_img, str):
+        size_img = tuple(int(i) for i in size_img.split(','))
+    return int(size_img[0]), int(size_img[1]) - config.get_blur_size()
+
+def crop_band_coverage(FACE_SIZE: int, latitude_band, geometry: tuple[int, int] = None) -> float:
+    """
+    Share of the crop window's rows (rows 0..y of the panorama, see get_crop_geometry) that lie
+    inside ±latitude_band; the rest of every crop comes out black in partial-sphere mode
+    """
+    if latitude_band is None:
+        return 1.0
+    _, y = geometry or get_crop_geometry()
+    y = min(y, 2 * int(FACE_SIZE))
+    if y <= 0:
+        return 1.0
+    band0, band1 = latitude_rows(FACE_SIZE, latitude_band)
+    return max(min(y, band1) - band0, 0) / y
+
+def crop_top_latitude(FACE_SIZE: int, geometry: tuple[int, int] = None) -> float:
+    """
+    Lowest latitude the crop window reaches (its bottom row)
+    """
+    _, y = geometry or get_crop_geometry()
+    return 90 - min(y, 2 * int(FACE_SIZE)) / (2 * int(FACE_SIZE)) * 180
+
+def output_region(FACE_SIZE: int, render_mode: str = "equirect", geometry: tuple[int, int] = None):
+    """
+    (row0, row1, col0, col1) of the equirectangular image reproject_stack renders: all of it,
+    or the crop window in crops mode. None when the crop geometry is empty.
+    """
+    H, W = 2 * int(FACE_SIZE), 4 * int(FACE_SIZE)
+    if render_mode != "crops":
+        return 0, H, 0, W
+    x, y = geometry or get_crop_geometry()
+    if x <= 0 or y <= 0:
+        return None
+    # only render what exists; split_crops then clips like slicing the full image would
+    return 0, min(y, H), 0, min(x, W)
+
+def split_crops(window: np.ndarray, geometry: tuple[int, int] = None) -> list[np.ndarray]:
+    """
+    The two halves ImageProcessorWorker._process_file cuts from the crop window
+    """
+    x, _ = geometry or get_crop_geometry()
+    return [window[:, :x // 2], window[:, x // 2:x]]
+
+def render_crops(stack: np.ndarray, mode: str = "nearest", geometry: tuple[int, int] = None, threads: int = 1,
+                 latitude_band=None, out: np.ndarray = None) -> list[np.ndarray]:
+    """
+    Render straight from the cube faces the two crops ImageProcessorWorker._process_file makes
+    of a full-resolution panorama ([0:y, 0:x//2] and [0:y, x//2:x]), without building the rest
+    of the equirectangular image. Pixel-identical to cropping the reprojected panorama.
+    """
+    geometry = geometry or get_crop_geometry()
+    region = output_region(stack.shape[1], "crops", geometry)
+    if region is None:
+        return []
+    window = render_window(stack, mode=mode, region=region, latitude_band=latitude_band, threads=threads, out=out)
+    return split_crops(window, geometry)
+
+def reproject_stack(stack: np.ndarray, mode: str = "nearest", render_mode: str = "equirect", threads: int = 1,
+                    latitude_band=None, out: np.ndarray = None):
+    """
+    Reproject a stacked face buffer and return the raw array, or the list of crop arrays when
+    render_mode is "crops". out: optional buffer shaped like output_region to render into.
+    """
+    if render_mode == "crops":
+        return render_crops(stack, mode=mode, threads=threads, latitude_band=latitude_band, out=out)
+    return render_window(stack, mode=mode, latitude_band=latitude_band, threads=threads, out=out)
+
+def crop_paths(save_folder: str, pano_path: str, count: int = 2) -> list[str]:
+    """
+    File names ImageProcessorWorker gives the crops of pano_path: <stem>_(0, i).jpg
+    """
+    stem = os.path.splitext(os.path.basename(pano_path))[0]
+    return [os.path.join(save_folder, f"{stem}_{(0, i)}.jpg") for i in range(count)]
+
+def _encode_jpeg(image: np.ndarray, f, quality: int):
+    Image.fromarray(image).save(f, "JPEG", quality=quality, subsampling="4:2:0", optimize=False)
+
+def _encode_webp(image: np.ndarray, f, quality: int):
+    Image.fromarray(image).save(f, "WEBP", quality=quality, method=4)
+
+def _encode_png(image: np.ndarray, f, quality: int):
+    level = int(config.get("Download", "png_compress_level", fallback="1"))
+    Image.fromarray(image).save(f, "PNG", compress_level=level)
+
+def _encode_npy(image: np.ndarray, f, quality: int):
+    # raw uint8 (H, W, 3) RGB, memory-mapped by later stages via utils.load_image
+    np.save(f, np.ascontiguousarray(image))
+
+# codec name → (file extension, encoder(image, file, quality))
+ENCODERS = {
+    "jpeg": (".jpg", _encode_jpeg),
+    "webp": (".webp", _encode_webp),
+    "png": (".png", _encode_png),
+    "npy": (".npy", _encode_npy),
+}
+
+def get_output_codec() -> str:
+    """
+    Panorama codec from [Download] output_codec
+    """
+    codec = config.get("Download", "output_codec", fallback="jpeg").strip().lower()
+    if codec not in ENCODERS:
+        raise ValueError(f"Unknown output codec {codec}. Expected one of {list(ENCODERS)}")
+    return codec
+
+def panorama_path(save_dir: str, pano_id: str, coords: tuple[float,float], region: str = None, codec: str = None) -> str:
+    """
+    Path of the stitched panorama for pano_id inside save_dir, with the extension of the output codec
+    """
+    region = region or config.get_general_data()['region']
+    ext = ENCODERS[codec or get_output_codec()][0]
+    lat, lng = coords
+    return os.path.join(save_dir, f"{region}_{pano_id}_{lat}_{lng}_360{ext}")
+
+def save_panorama(image, path: str, quality: int = None):
+    """
+    Encode and write a panorama given as a PIL Image or a uint8 array. The codec follows the
+    file extension (see ENCODERS). The file is written under a temporary name and renamed,
+    so a crash never leaves a partial image.
+    """
+    if isinstance(image, Image.Image):
+        image = np.asarray(image.convert("RGB"))
+    ext = os.path.splitext(path)[1].lower()
+    codec = next((name for name, (e, _) in ENCODERS.items() if e == ext), "jpeg")
+    quality = int(quality or config.get("Download", "output_quality", fallback="90"))
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.part"
+    with open(tmp, "wb") as f:
+        ENCODERS[codec][1](image, f, quality)
+    os.replace(tmp, path)
+
+def get_pyramid_levels() -> list[tuple[int, int]]:
+    """
+    Pyramid sizes from [Download] pyramid_levels, e.g. "2048x1024,512x256". Empty means no pyramid.
+    """
+    raw = config.get("Download", "pyramid_levels", fallback="") or ""
+    levels = []
+    for item in raw.split(","):
+        item = item.strip().lower()
+        if item:
+            width, height = item.split("x")
+            levels.append((int(width), int(height)))
+    return sorted(levels, reverse=True)
+
+def build_pyramid(image, levels: list[tuple[int, int]]) -> dict[tuple[int, int], Image.Image]:
+    """
+    Downscale one reprojected panorama to every requested size. Each level is resized from
+    the previous (larger) one, so the full-resolution image is only read once.
+    """
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    pyramid = {}
+    source = image
+    for size in sorted(levels, reverse=True):
+        if source.size == size:
+            level = source
+        else:
+            level = source.resize(size, Image.BOX, reducing_gap=2.0)
+        pyramid[size] = level
+        source = level
+    return pyramid
+
+def save_pyramid(image, path: str, levels: list[tuple[int, int]] = None) -> list[str]:
+    """
+    Write the pyramid levels of a panorama next to its full image (see utils.pyramid_level_path)
+    """
+    levels = get_pyramid_levels() if levels is None else levels
+    paths = []
+    for size, level in build_pyramid(image, levels).items():
+        level_path = str(pyramid_level_path(path, size))
+        save_panorama(level, level_path)
+        paths.append(level_path)
+    return paths
+
+def download_panorama(pano_id: str, save_dir: str, coords: tuple[float,float], face = None):
     region = config.get_general_data()['region']
     logger.log_status("Started Panaroma Download")
     try:
-        faces = fetch_cube_faces(pano_id, logger=logger)
-        eq = cube_to_equirectangular(faces, face)
-        lat, lng = coords
-        os.makedirs(save_dir, exist_ok=True)
-        filename = f"{region}_{pano_id}_{lat}_{lng}_360.jpg"
-        path = os.path.join(save_dir, filename)
-        eq.save(path, "JPEG")
+        face = face or int(config.get_download_data()['face_size'])
+        latitude_band = get_latitude_band()
+        faces = fetch_cube_faces(pano_id, logger=logger, FACE_SIZE=face, names=get_fetch_faces(latitude_band))
+        mode = config.get("Download", "interpolation", fallback="nearest")
+        eq = cube_to_equirectangular(faces, face, mode=mode, latitude_band=latitude_band)
+        path = panorama_path(save_dir, pano_id, coords, region)
+        save_panorama(eq, path)
+        save_pyramid(eq, path)
         logger.log_status(f"Panaromas Downloaded successfully to {path}")
     except Exception as e:
         logger.log_exception(f"Error while downloading Panaromas: {e}")
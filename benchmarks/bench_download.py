@@ -0,0 +1,102 @@
+# Download-path throughput benchmark against the offline Street View stand-in.
+# Reports panoramas per minute, mean per-stage latency and retry overhead for the serial
+# download_panorama loop and for PanoramaPipeline, under a few fault scenarios.
+# Usage:
+#   python benchmarks/bench_download.py --panos 24 --face-size 512 --latency-ms 120
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import Tile_Downloader
+from Download_Pipeline import PanoramaPipeline
+from fake_streetview_server import FakeStreetViewServer
+
+# name → fault settings passed to the fake server
+SCENARIOS = {
+    "clean": {},
+    "5xx 2%": {"error_rate": 0.02},
+    "5xx bursts": {"burst_every": 60, "burst_length": 3},
+    "429 1%": {"rate_429": 0.01, "retry_after": 1.0},
+}
+
+
+def configure(config, base_url: str, workdir: str, face_size: int):
+    """
+    Point the in-memory config (never saved) at the stand-in and at throwaway files
+    """
+    config.parser.set("Download", "api_base_url", base_url)
+    config.parser.set("Download", "face_size", str(face_size))
+    config.parser.set("Download", "face_cache_enabled", "False")
+    config.parser.set("Paths", "download_manifest_path", os.path.join(workdir, "manifest.db"))
+    if not config.parser.has_section("Quota"):
+        config.parser.add_section("Quota")
+    config.parser.set("Quota", "streetview_per_minute", "1000000")
+    config.parser.set("Quota", "metadata_per_minute", "1000000")
+    config.parser.set("Quota", "usage_file", os.path.join(workdir, "quota_usage.json"))
+    os.environ.setdefault("API_KEY", "offline-benchmark")
+
+
+def run_serial(jobs, out_dir, face_size):
+    t0 = time.perf_counter()
+    for lat, lng, pano_id in jobs:
+        Tile_Downloader.download_panorama(pano_id, out_dir, (lat, lng), face_size)
+    return time.perf_counter() - t0, None
+
+
+def run_pipeline(jobs, out_dir, face_size):
+    pipeline = PanoramaPipeline(out_dir, Tile_Downloader.logger, Tile_Downloader.config)
+    t0 = time.perf_counter()
+    pipeline.run(jobs)
+    return time.perf_counter() - t0, pipeline
+
+
+def bench(panos: int, face_size: int, latency_ms: float, modes: list[str]):
+    workdir = tempfile.mkdtemp(prefix="sv_bench_")
+    server = FakeStreetViewServer(latency_ms=latency_ms).start()
+    configure(Tile_Downloader.config, server.base_url, workdir, face_size)
+    Tile_Downloader.get_remap_table(face_size)
+    print(f"stand-in at {server.base_url}, {panos} panoramas, face size {face_size}, latency {latency_ms} ms")
+    print(f"{'scenario':<12}{'mode':<10}{'pano/min':>10}{'requests':>10}{'retries':>9}{'wall s':>9}  stages")
+
+    clean_wall = {}
+    try:
+        for scenario, faults in SCENARIOS.items():
+            for key in ("error_rate", "burst_every", "burst_length", "rate_429"):
+                setattr(server, key, faults.get(key, 0))
+            server.retry_after = faults.get("retry_after", 1.0)
+
+            for mode in modes:
+                out_dir = tempfile.mkdtemp(dir=workdir)
+                # unique pano ids per run so the manifest never skips anything
+                jobs = [(0.0, 0.0, f"{scenario}-{mode}-{i}") for i in range(panos)]
+                server.reset_stats()
+                runner = run_serial if mode == "serial" else run_pipeline
+                wall, pipeline = runner(jobs, out_dir, face_size)
+
+                requests_made = server.stats["streetview"]
+                retries = requests_made - 6 * panos
+                rate = panos / wall * 60
+                stages = pipeline.stage_summary() if pipeline else "-"
+                if scenario == "clean":
+                    clean_wall[mode] = wall
+                overhead = wall - clean_wall.get(mode, wall)
+                print(f"{scenario:<12}{mode:<10}{rate:>10.1f}{requests_made:>10}{retries:>9}{wall:>9.2f}  "
+                      f"{stages}  ({overhead:+.2f}s vs clean)")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the panorama download path offline")
+    parser.add_argument("--panos", type=int, default=24)
+    parser.add_argument("--face-size", type=int, default=512)
+    parser.add_argument("--latency-ms", type=float, default=120.0)
+    parser.add_argument("--modes", default="serial,pipeline", help="comma separated: serial, pipeline")
+    args = parser.parse_args()
+    bench(args.panos, args.face_size, args.latency_ms, [m.strip() for m in args.modes.split(",") if m.strip()])
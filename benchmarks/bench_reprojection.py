@@ -0,0 +1,58 @@
+# Reprojection benchmark: ms per output megapixel for each interpolation mode and thread count
+# Usage:
+#   python benchmarks/bench_reprojection.py --face-size 1024 --repeats 5 --threads 1,2,4,8
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Tile_Downloader import FACE_ORDER, INTERPOLATION_MODES, get_remap_table, stack_faces, reproject
+
+
+def synthetic_faces(face_size: int, seed: int = 0) -> dict[str, np.ndarray]:
+    """
+    Random uint8 faces, enough to exercise the gather without touching the API
+    """
+    rng = np.random.default_rng(seed)
+    return {name: rng.integers(0, 256, (face_size, face_size, 3), dtype=np.uint8) for name in FACE_ORDER}
+
+
+def bench(face_size: int, repeats: int, threads: list[int]) -> dict[tuple[str, int], float]:
+    t0 = time.perf_counter()
+    table = get_remap_table(face_size)
+    print(f"remap table ready in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    buffer = np.empty((6, face_size, face_size, 3), dtype=np.uint8)
+    stack = stack_faces(synthetic_faces(face_size), face_size, out=buffer)
+    megapixels = (4 * face_size) * (2 * face_size) / 1e6
+
+    out = np.empty((2 * face_size, 4 * face_size, 3), dtype=np.uint8)
+
+    results = {}
+    for mode in INTERPOLATION_MODES:
+        reproject(stack, mode=mode, table=table, out=out)  # warm up page cache / mmap
+        for count in threads:
+            timings = []
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                reproject(stack, mode=mode, table=table, out=out, threads=count)
+                timings.append(time.perf_counter() - t0)
+            best = min(timings) * 1000
+            results[(mode, count)] = best / megapixels
+            speedup = results[(mode, threads[0])] / results[(mode, count)]
+            print(f"{mode:>9} x{count:<3}: {best:8.1f} ms/pano  {results[(mode, count)]:6.2f} ms/MP  "
+                  f"speedup {speedup:4.2f}  ({megapixels:.1f} MP)")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark cube-to-equirectangular reprojection")
+    parser.add_argument("--face-size", type=int, default=1024)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", default=f"1,{os.cpu_count() or 1}", help="comma separated thread counts")
+    args = parser.parse_args()
+    bench(args.face_size, args.repeats, [int(t) for t in args.threads.split(",")])
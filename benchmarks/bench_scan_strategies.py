@@ -0,0 +1,99 @@
+# Scan strategy benchmark: metadata calls paid per unique panorama on a synthetic city
+# (dense road grid in the centre, sparse rural roads around it, a panorama every ~20 m of road).
+# Metadata is answered in-process like the real API: the nearest panorama within 50 m, if any.
+# Usage:
+#   python benchmarks/bench_scan_strategies.py --budget 0
+
+import os
+import sys
+import math
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from AppLogger import Logger
+from Scan_Database import init_scan_db, connect
+from Scan_Engine import ScanEngine
+from Scan_Planner import plan_scan
+from Scan_Strategies import GridStrategy, QuadtreeStrategy, HexStrategy
+
+# scanned area (north, south, east, west), about 4.4 km square
+BOUNDS = (28.64, 28.60, 77.24, 77.20)
+
+
+class SyntheticCity:
+    def __init__(self, core=0.012, core_gap=0.001, rural_gap=0.01, pano_gap=0.0002, radius=0.00045,
+                 offset=(0.00013, 0.00029)):
+        """
+        Roads every core_gap degrees inside a central core square and every rural_gap outside,
+        shifted by offset so they don't line up with the scan lattice
+        """
+        self.radius = radius
+        self.bucket = 0.0005
+        self.buckets = {}
+        self.count = 0
+        north, south, east, west = BOUNDS
+        lat0, lon0 = south + offset[0], west + offset[1]
+        size = north - south
+        core_lat, core_lon = lat0 + (size - core) / 2, lon0 + (size - core) / 2
+        for start_lat, start_lon, extent, gap in ((core_lat, core_lon, core, core_gap), (lat0, lon0, size, rural_gap)):
+            for k in range(int(round(extent / gap)) + 1):
+                for j in range(int(extent / pano_gap) + 1):
+                    self._add(start_lat + k * gap, start_lon + j * pano_gap)
+                    self._add(start_lat + j * pano_gap, start_lon + k * gap)
+
+    def _add(self, lat, lon):
+        self.count += 1
+        key = (int(lat // self.bucket), int(lon // self.bucket))
+        self.buckets.setdefault(key, []).append((lat, lon, f"SYN{self.count}"))
+
+    def metadata(self, lat, lon) -> dict:
+        bi, bj = int(lat // self.bucket), int(lon // self.bucket)
+        best = None
+        for i in (bi - 1, bi, bi + 1):
+            for j in (bj - 1, bj, bj + 1):
+                for plat, plon, pano_id in self.buckets.get((i, j), ()):
+                    d = math.hypot(plat - lat, plon - lon)
+                    if d <= self.radius and (best is None or d < best[0]):
+                        best = (d, pano_id, plat, plon)
+        if best is None:
+            return {"status": "ZERO_RESULTS"}
+        return {"status": "OK", "pano_id": best[1], "location": {"lat": best[2], "lng": best[3]}, "date": "2024-01"}
+
+
+def run(city: SyntheticCity, strategy, budget: int, logger: Logger):
+    db_path = tempfile.mktemp(suffix=".db")
+    init_scan_db(db_path)
+    conn = connect(db_path)
+    plan = plan_scan(conn, strategy.seed_grid(*BOUNDS))
+    conn.close()
+    engine = ScanEngine(db_path, city.metadata, logger, concurrency=8, strategy=strategy, bounds=BOUNDS,
+                        call_budget=budget, writer_settings={"flush_interval": 0.05}, plan=plan)
+    engine.run()
+    return plan.expected_calls, engine.requests, engine.unique, engine.calls_per_pano()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", type=int, default=0, help="call budget per strategy, 0 for none")
+    args = parser.parse_args()
+
+    logger = Logger(__name__)
+    city = SyntheticCity()
+    strategies = {
+        "grid 0.003/0.001": GridStrategy(0.003, 0.001),
+        "grid 0.001/0.0005": GridStrategy(0.001, 0.0005),
+        "quadtree depth 4": QuadtreeStrategy(0.008, max_depth=4),
+        "quadtree depth 5": QuadtreeStrategy(0.008, max_depth=5),
+        "hex 50 m": HexStrategy(50),
+    }
+    print(f"synthetic city with {city.count} panoramas")
+    print(f"{'strategy':<20}{'planned':>8}{'calls':>8}{'unique':>8}{'calls/pano':>12}")
+    for name, strategy in strategies.items():
+        planned, calls, unique, per_pano = run(city, strategy, args.budget, logger)
+        print(f"{name:<20}{planned:>8}{calls:>8}{unique:>8}{per_pano:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# Local stand-in for the Street View Static API (streetview and streetview/metadata endpoints).
+# Serves synthetic faces with configurable latency, random 5xx, 5xx bursts and 429s, so the
+# download path can be exercised and benchmarked without spending quota.
+# Usage:
+#   python benchmarks/fake_streetview_server.py --port 8765 --latency-ms 120 --error-rate 0.02
+# then set [Download] api_base_url = http://127.0.0.1:8765/streetview
+
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from io import BytesIO
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+from PIL import Image
+
+
+class FakeStreetViewServer:
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=100.0, jitter_ms=20.0, error_rate=0.0,
+                 burst_every=0, burst_length=0, rate_429=0.0, retry_after=1.0, hit_rate=0.7,
+                 pano_spacing=0.0005, seed=0):
+        """
+        Args:
+            latency_ms / jitter_ms (float): Mean response delay and its uniform +/- spread
+            error_rate (float): Probability that any request answers 503
+            burst_every / burst_length (int): Every burst_every requests, answer the next burst_length with 500
+            rate_429 (float): Probability of 429 with a Retry-After of retry_after seconds
+            hit_rate (float): Share of metadata locations that return status OK
+            pano_spacing (float): Metadata snaps locations to a lattice of this spacing (degrees) to mint pano ids
+        """
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.hit_rate = hit_rate
+        self.pano_spacing = pano_spacing
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.burst_left = 0
+        self.stats = {"streetview": 0, "metadata": 0, "200": 0, "429": 0, "5xx": 0}
+        self._faces = {}
+
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/streetview"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {key: 0 for key in self.stats}
+
+    # --- responses ---
+
+    def face_jpeg(self, size: int, heading: int, pitch: int) -> bytes:
+        """
+        A gradient face tinted by view direction, encoded once per (size, heading, pitch)
+        """
+        key = (size, heading, pitch)
+        if key not in self._faces:
+            ramp = np.linspace(0, 255, size, dtype=np.float32)
+            img = np.empty((size, size, 3), dtype=np.uint8)
+            img[..., 0] = ramp[None, :]
+            img[..., 1] = ramp[:, None]
+            img[..., 2] = (heading * 0.7 + (pitch + 90)) % 256
+            buf = BytesIO()
+            Image.fromarray(img).save(buf, "JPEG", quality=85)
+            self._faces[key] = buf.getvalue()
+        return self._faces[key]
+
+    def metadata(self, location: str) -> dict:
+        lat, lon = (float(v) for v in location.split(","))
+        cell = (round(lat / self.pano_spacing), round(lon / self.pano_spacing))
+        digest = hashlib.sha1(f"{cell[0]},{cell[1]}".encode()).hexdigest()
+        if int(digest[:8], 16) / 0xFFFFFFFF > self.hit_rate:
+            return {"status": "ZERO_RESULTS"}
+        return {
+            "status": "OK",
+            "pano_id": f"FAKE{digest[:18]}",
+            "location": {"lat": cell[0] * self.pano_spacing, "lng": cell[1] * self.pano_spacing},
+            "date": "2024-01",
+        }
+
+    def _fault(self):
+        """
+        Decide whether the next request fails: returns (status, headers) or None
+        """
+        with self.lock:
+            self.requests += 1
+            if self.burst_every and self.requests % self.burst_every == 0:
+                self.burst_left = self.burst_length
+            if self.burst_left > 0:
+                self.burst_left -= 1
+                return 500, {}
+            roll = self.random.random()
+            if roll < self.rate_429:
+                return 429, {"Retry-After": f"{self.retry_after:g}"}
+            if roll < self.rate_429 + self.error_rate:
+                return 503, {}
+        return None
+
+    def _count(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.stats[key] += 1
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body=b"", content_type="text/plain", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                endpoint = "metadata" if url.path.rstrip("/").endswith("/metadata") else "streetview"
+                server._count(endpoint)
+
+                delay = server.latency + server.random.uniform(-server.jitter, server.jitter)
+                time.sleep(max(0.0, delay))
+
+                fault = server._fault()
+                if fault:
+                    status, headers = fault
+                    server._count("429" if status == 429 else "5xx")
+                    return self._send(status, b"fake error", headers=headers)
+
+                if endpoint == "metadata":
+                    body = json.dumps(server.metadata(query.get("location", "0,0"))).encode()
+                    server._count("200")
+                    return self._send(200, body, "application/json")
+
+                size = int(query.get("size", "640x640").split("x")[0])
+                body = server.face_jpeg(size, int(float(query.get("heading", 0))), int(float(query.get("pitch", 0))))
+                server._count("200")
+                return self._send(200, body, "image/jpeg")
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline Street View API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--burst-every", type=int, default=0)
+    parser.add_argument("--burst-length", type=int, default=0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--hit-rate", type=float, default=0.7)
+    args = parser.parse_args()
+
+    server = FakeStreetViewServer(
+        args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate,
+        args.burst_every, args.burst_length, args.rate_429, args.retry_after, args.hit_rate)
+    print(f"Serving fake Street View API at {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
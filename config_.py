@@ -41,7 +41,7 @@ class Config:
             self.parser["General"] = {
                 "name_of_main_app": "ML Assist",
                 "version": "1.0.0",
-                "allowed_file_types": ".jpg,.png,.jpeg",
+                "allowed_file_types": ".jpg,.png,.jpeg,.webp",
                 "size_of_images": "2048,1024",
                 "blur_region_height": "250",
                 "name_of_api_window": "Download",
@@ -62,16 +62,64 @@ class Config:
                 "map_index_path": "index_map.json",
                 "classification_save_folder_path": "data\\Classified",
                 "metadata_database_path": "scan_data.db",
-                "secrets_path": "secrets.env"
+                "secrets_path": "secrets.env",
+                "download_manifest_path": "download_manifest.db"
             }
 
             self.parser["Download"] = {
                 "face_size": "1024",
+                "api_base_url": "https://maps.googleapis.com/maps/api/streetview",
+                "remap_cache_folder": "cache\\remap",
+                "interpolation": "nearest",
+                "reproject_memory_mb": "32",
+                "reproject_threads": "0",
+                "partial_sphere": "False",
+                "latitude_band": "35",
+                "prescreen": "False",
+                "prescreen_face_size": "128",
+                "prescreen_threshold": "0.25",
+                "prescreen_faces": "right,left",
+                "http_pool_size": "32",
+                "face_fetch_workers": "12",
+                "fetch_workers": "4",
+                "reproject_workers": "0",
+                "writer_workers": "2",
+                "pipeline_queue_size": "8",
+                "face_cache_enabled": "True",
+                "face_cache_folder": "cache\\faces",
+                "face_cache_max_mb": "4096",
+                "pyramid_levels": "",
+                "output_codec": "jpeg",
+                "output_quality": "90",
+                "png_compress_level": "1",
+                "render_mode": "equirect",
                 "coarse_spacing": "0.003",
                 "fine_spacing": "0.001",
                 "file_name": "map.html"
             }
 
+            self.parser["Quota"] = {
+                "metadata_per_minute": "30000",
+                "streetview_per_minute": "30000",
+                "metadata_daily_budget": "0",
+                "streetview_daily_budget": "0",
+                "usage_file": "quota_usage.json"
+            }
+
+            self.parser["Scanner"] = {
+                "writer_batch_size": "500",
+                "writer_flush_seconds": "1.0",
+                "writer_synchronous": "NORMAL",
+                "strategy": "grid",
+                "call_budget": "0",
+                "quadtree_root_spacing": "0.008",
+                "quadtree_max_depth": "4",
+                "quadtree_min_depth": "1",
+                "quadtree_novelty": "0.3",
+                "metadata_radius": "50",
+                "prune_known_panos": "True"
+            }
+
             self.parser["BUILDING_DETECTION"] = {
                 "model_path": "models\\faster_rcnn",
                 "model_url": "https://tfhub.dev/google/faster_rcnn/openimages_v4/inception_resnet_v2/1?tf-hub-format=compressed, Dummy",
@@ -176,10 +224,33 @@ class Config:
         """
         try:
             return self.parser.get(section, option)
-        except configparser.NoOptionError:
+        except (configparser.NoSectionError, configparser.NoOptionError):
+            # config files written before a section was added have neither the section nor its options
             self.logger.log_status(f"Option {option} in section {section} not found. Using fallback value.", "WARNING")
             return fallback
     
+    def get_bool(self, section, option, fallback: bool = False) -> bool:
+        """
+        Get a boolean configuration option (true/false, yes/no, on/off, 1/0), with a fallback value
+        if the option is missing or not a boolean.
+
+        Args:
+            section (str): The section name in the config file.
+            option (str): The option name within the section.
+            fallback (bool): The value to return if the option doesn't exist.
+
+        Returns:
+            bool: The value of the option or the fallback value.
+        """
+        try:
+            return self.parser.getboolean(section, option)
+        except (configparser.NoSectionError, configparser.NoOptionError):
+            self.logger.log_status(f"Option {option} in section {section} not found. Using fallback value.", "WARNING")
+            return fallback
+        except ValueError:
+            self.logger.log_status(f"Option {option} in section {section} is not a boolean. Using fallback value.", "WARNING")
+            return fallback
+
     def get_all(self, section):
         """
         Get the values of all values in a configuration section.
@@ -245,6 +316,20 @@ class Config:
         section = 'Download'
         return self.get_all(section = section)
 
+    def get_quota_data(self):
+        """
+        Get the API rate limits and daily budgets
+        """
+        section = 'Quota'
+        return self.get_all(section = section)
+
+    def get_scanner_data(self):
+        """
+        Get the metadata scanner settings
+        """
+        section = 'Scanner'
+        return self.get_all(section = section)
+
     def get_building_detection_data(self) -> dict:
         """
         Get the current Building Detection settings
@@ -360,6 +445,19 @@ class Config:
         """
         return Path(resolve_path(self.get_paths_data()['metadata_database_path']))
 
+    def get_download_manifest_path(self) -> Path:
+        """
+        Get the path to the SQLite manifest that records which panoramas were already downloaded
+        """
+        return Path(resolve_path(self.get("Paths", "download_manifest_path", fallback="download_manifest.db")))
+
+    def get_streetview_base_url(self) -> str:
+        """
+        Base URL of the Street View Static API; metadata lives under <base>/metadata.
+        Point it at benchmarks/fake_streetview_server.py to work offline.
+        """
+        return self.get("Download", "api_base_url", fallback="https://maps.googleapis.com/maps/api/streetview").rstrip("/")
+
     def get_current_working_folder(self) -> Path:
         """
         Get the current folder path from the config.
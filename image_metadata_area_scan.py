@@ -1,7 +1,6 @@
 import sys
 import os
 import json
-import time
 import requests
 import threading
 from tenacity import retry, retry_if_exception, wait_exponential, stop_after_attempt
@@ -9,6 +8,14 @@ from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QLabel, QLineEd
                              QProgressBar, QHBoxLayout, QMessageBox)
 from PyQt5.QtCore import Qt, QTimer
 
+from AppLogger import Logger
+logger = Logger(__name__)
+
+from config_ import Config
+config = Config(logger=logger)
+
+from Quota_Manager import get_quota_manager, QuotaExceeded, retry_if_rate_limited
+
 SAVE_FILE = "scan_progress.json"
 
 class StreetViewScanner(QWidget):
@@ -103,10 +110,16 @@ class StreetViewScanner(QWidget):
     @retry(
         wait=wait_exponential(multiplier=1, min=2, max=10),
         stop=stop_after_attempt(3),
-        retry=retry_if_exception(retry_if_5xx_error)
+        retry=retry_if_exception(retry_if_5xx_error) | retry_if_exception(retry_if_rate_limited)
     )
     def safe_get(self, url, params = None):
-        return requests.get(url=url, params=params)
+        # paced by the process-wide quota service; raises QuotaExceeded once the daily budget is spent
+        quota = get_quota_manager(config, logger)
+        quota.acquire("metadata")
+        response = requests.get(url=url, params=params)
+        quota.on_response("metadata", response)
+        response.raise_for_status()
+        return response
 
 
     def scan_area(self):
@@ -115,9 +128,14 @@ class StreetViewScanner(QWidget):
             lon = self.progress.get("next_lon", self.west)
             while lon <= self.east:
                 location = f"{lat},{lon}"
-                metadata_url = f"https://maps.googleapis.com/maps/api/streetview/metadata?location={location}&key={self.api_key}"
-                response = self.safe_get(url = metadata_url)
-                response.raise_for_status()
+                metadata_url = f"{config.get_streetview_base_url()}/metadata?location={location}&key={self.api_key}"
+                try:
+                    response = self.safe_get(url = metadata_url)
+                except QuotaExceeded:
+                    self.progress['latest_status'] = "Daily metadata budget reached. Come back tomorrow."
+                    self.scanning = False
+                    self.save_progress()
+                    return
                 result = response.json()
 
                 if result.get("status") == "OK":
@@ -128,13 +146,6 @@ class StreetViewScanner(QWidget):
                 self.progress['next_lon'] = lon + self.grid_spacing
                 self.save_progress()
 
-                time.sleep(1.5)  # rate limit for free tier
-
-                if len(self.progress['scanned']) >= 90:
-                    self.progress['latest_status'] = "Free tier limit reached. Come back tomorrow."
-                    self.scanning = False
-                    return
-
             lat -= self.grid_spacing
             self.progress['next_lon'] = self.west
         self.scanning = False
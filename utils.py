@@ -2,6 +2,8 @@ from pathlib import Path
 import tkinter as tk
 import shutil
 import os, cv2
+import numpy as np
+from PIL import Image
 
 def resolve_path(rel_path: str) -> str:
     """
@@ -115,10 +117,60 @@ def cleanup_process(check_value, folder: Path):
 
 def save_image(image, path, logger=None):
     try:
-        cv2.imwrite(str(path), image)
+        # crops of memory-mapped .npy panoramas are strided views
+        cv2.imwrite(str(path), np.ascontiguousarray(image))
         logger.log_status(f"Saved image to {path}")
         return True, path
     except Exception as e:
         if logger:
             logger.log_exception(e)
-        return False, path
\ No newline at end of file
+        return False, path
+
+def pyramid_level_path(path, size: tuple[int, int]) -> Path:
+    """
+    Where the (width, height) pyramid level of a panorama is stored: a pyramid/WxH folder
+    next to the full image, with the same file name. Kept out of the image folder itself so
+    the level files are not picked up as separate panoramas.
+    """
+    path = Path(path)
+    width, height = size
+    return path.parent / "pyramid" / f"{width}x{height}" / path.name
+
+def load_image(path):
+    """
+    Reads an image as a BGR array like cv2.imread, also accepting the downloader's raw .npy
+    panoramas (RGB, opened memory-mapped). Returns None if the file can't be read.
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".npy":
+        try:
+            return np.load(path, mmap_mode="r")[..., ::-1]
+        except (OSError, ValueError):
+            return None
+    return cv2.imread(str(path))
+
+def load_preview(path, min_width: int):
+    """
+    Reads the smallest pyramid level of a panorama that is at least min_width wide, or the full
+    image when there is none, for display. Returns (image, scale), scale being the level's
+    height over the full image's, so full-resolution pixel geometry can be drawn on it.
+    """
+    path = Path(path)
+    levels = []
+    for folder in (path.parent / "pyramid").glob("*x*"):
+        try:
+            width, height = (int(v) for v in folder.name.split("x"))
+        except ValueError:
+            continue
+        if width >= min_width and (folder / path.name).exists():
+            levels.append((width, height))
+    if not levels:
+        return load_image(path), 1.0
+    width, height = min(levels)
+    # only the header of the full image is read
+    if path.suffix.lower() == ".npy":
+        full_height = np.load(path, mmap_mode="r").shape[0]
+    else:
+        with Image.open(path) as image:
+            full_height = image.size[1]
+    return load_image(pyramid_level_path(path, (width, height))), height / full_height